@@ -1,26 +1,27 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import folium
-from streamlit_folium import st_folium
-from streamlit.components.v1 import html
 import numpy as np
-import shutil
-from bs4 import BeautifulSoup
-import pathlib
+import uuid
+from contextlib import contextmanager
+from whatif import SimulationState
+from data_loader import cost_model, enrollment_trends, filter_index, load_data, redistribution_cache, sampling_totals, school_clusters, school_index, school_names
+from capacity_buckets import bucket_names, bucket_tiles, classify, transition_matrix
+from presets import PROPOSED_OPTION_A, PROPOSED_OPTION_B
+from uncertainty import simulate
+from constrained import constrained_redistribution
+from projection import project_closures, projection_summary
+from savings import net_savings
+from marginal import marginal_impact
+from clustering import CLUSTER_COUNTS, FEATURE_COLUMNS, FEATURE_SET_NAMES, FEATURE_SETS, FEATURE_WEIGHTS, similar_schools
+from tables import TABLE_FORMATS, closing_schools_table, impacted_schools_table
+from profiling import RunProfile
+from engine import apply_redistribution, redistribution_columns
+from scenario_store import QUERY_PARAM, decode_scenario, encode_scenario, open_store
 
 
 
 st.set_page_config(layout="wide")
 
-def determine_color(capacity_percent):
-    if float(capacity_percent) < 0.75:
-        return low_range_color
-    elif float(capacity_percent) < 0.95 and float(capacity_percent) >= 0.75:
-        return mid_range_color
-    else:
-        return high_range_color
-    
 def sync_dataframes(df1, df2, column_name):
     # Ensure the column exists in both dataframes
     if column_name not in df1.columns or column_name not in df2.columns:
@@ -35,81 +36,39 @@ def sync_dataframes(df1, df2, column_name):
     
     return df1
 
-def move_column(dataframe, column, position):
-    cols = list(dataframe.columns)
-    cols.insert(position, cols.pop(cols.index(column)))
-    return dataframe[cols]
 
+# Per-stage timings for this rerun, logged as one JSON line at the end of the script and
+# shown in the sidebar when the page is opened with ?debug
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex[:12]
+profile = RunProfile(st.session_state['session_id'])
+debug = 'debug' in st.query_params
+
+# Load data, parsed and cleaned once per process and shared between sessions
+with profile.stage('load'):
+    checksum, base_data, matrix, counts = load_data()
+    data = base_data.copy()
+    index = filter_index(checksum)
+    bounds = index.bounds
+    store = open_store(checksum)
+
+# A shared link carries its closure set in the query string. It's applied once, on the
+# session's first run, the same way the proposed options are: no filters, and the
+# closed schools selected by hand.
+if 'permalink_loaded' not in st.session_state:
+    st.session_state['permalink_loaded'] = True
+    if QUERY_PARAM in st.query_params:
+        try:
+            shared = decode_scenario(st.query_params[QUERY_PARAM], checksum, len(base_data))
+            st.session_state['selected_options'] = ['Enrollment Total']
+            st.session_state['enrollment_range'] = (0, 0)
+            st.session_state['manual_school'] = list(base_data['School'][shared])
+        except ValueError as error:
+            st.warning(f"The shared scenario couldn't be loaded: {error}.")
+
+# Capacity buckets used by the metric tiles
+capacity_thresholds = (0.75, 1.0)
 
-def reallocate_student_counts(student_counts, redistribution_matrix, closed_schools):
-    # Convert input lists to numpy arrays for easy manipulation
-    student_counts = np.array(student_counts, dtype=float)
-    redistribution_matrix = np.array(redistribution_matrix, dtype=float)
-    closed_schools = set(closed_schools)
-
-    # Initialize current student counts
-    current_student_counts = np.copy(student_counts)
-    num_schools = len(student_counts)
-    
-    while True:
-        new_counts = np.copy(current_student_counts)
-        any_redistributed = False
-        
-        for school in closed_schools:
-            if current_student_counts[school] > 0:
-                any_redistributed = True
-                total_redistributed = current_student_counts[school]
-                
-                # Adjust redistribution percentages to only consider open schools
-                redistribution_percentages = np.copy(redistribution_matrix[school])
-                redistribution_percentages[list(closed_schools)] = 0
-                total_percentage = np.sum(redistribution_percentages)
-                
-                if total_percentage > 0:
-                    redistribution_percentages /= total_percentage
-                
-                for i in range(num_schools):
-                    if i not in closed_schools:
-                        new_counts[i] += total_redistributed * redistribution_percentages[i]
-                
-                new_counts[school] = 0
-        
-        if not any_redistributed:
-            break
-        
-        current_student_counts = new_counts
-    
-    return current_student_counts
-
-# Load data
-data = pd.read_csv('data/performance_data_2023.csv')
-matrix = pd.read_csv('data/redistribution_matrix.csv',index_col=0)
-counts = data[['Total AAFTE* Enrollment (ENROLLMENT)']].transpose().values[0]
-
-
-# Clean data\
-data = data.rename(columns=lambda x: x.strip()).drop(columns=['Unnamed: 0'])
-data['Necessary Budget'] = 500000 + data['Total Budget (BUDGET)']
-data['Budget Efficiency'] = data['Total Budget (BUDGET)'] / data['Total AAFTE* Enrollment (ENROLLMENT)']
-data['Landmark'] = data['Landmark'].fillna('N')
-data['Building Condition Score'] = data['Building Condition Score'].fillna(0)
-data['Building Condition'] = data['Building Condition'].fillna('0. None')
-data['Landmark'] = data['Landmark'].replace({'None': 'N', 'NA': 'N', '0': 'N', 0:'N'})
-data['Use'] = data['Use'].replace({'0':'K-12', 0:'K-12'})
-data['Enrollment from Redistribution'] = 0
-data['Redistribution Capacity'] = data['Capacity Percent']
-data['Total Enrollment'] = data['Total AAFTE* Enrollment (ENROLLMENT)']
-data.drop(columns='Year', inplace=True)
-
-                                    
-
-# Move the rightmost column to the leftmost position
-#columns = data.columns.tolist()
-#columns = [columns[-1]] + columns[:-1]
-#data = data[columns]
-
-# Rename latitude and longitude columns to lowercase due to nuances with folium
-data = data.rename(columns={'Latitude': 'latitude', 'Longitude': 'longitude'})
 
 # Title
 
@@ -119,7 +78,7 @@ data = data.rename(columns={'Latitude': 'latitude', 'Longitude': 'longitude'})
 st.sidebar.header('Adjust Filters to Identify Schools to Simulate Closing:')
 
 selected_options =  st.sidebar.multiselect("Choose any number of metrics for Targeting Schools...", 
-                                           ['Building Capacity','School Budget','School Type','Building Condition Score', 'Distance to Closest School','Excess Budget per Student', 'Disadvantage Score','Enrollment Total', 'Capacity Total','School Landmark Status'], ['Enrollment Total'], key='selected_options')
+                                           ['Building Capacity','School Budget','School Type','Building Condition Score', 'Distance to Closest School','Excess Budget per Student', 'Disadvantage Score','Enrollment Total', 'Capacity Total','School Landmark Status', 'Similar Schools', 'Schools Within Distance'], ['Enrollment Total'], key='selected_options')
 
 color_options = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige',
                  'darkblue', 'darkgreen', 'cadetblue', 'darkpurple', 'white', 'pink',
@@ -137,95 +96,146 @@ else:
 if 'School Budget' in selected_options:
     budget_range = st.sidebar.slider("School's Budget Range:", key='budget',
                                  min_value=0, 
-                                 max_value=int(data['Total Budget (BUDGET)'].max()), 
-                                 value=(0, int(data['Total Budget (BUDGET)'].max())),format='$%d')
+                                 max_value=int(bounds['Total Budget (BUDGET)'][1]), 
+                                 value=(0, int(bounds['Total Budget (BUDGET)'][1])),format='$%d')
 else:
-    budget_range = (0, int(data['Total Budget (BUDGET)'].max()))
+    budget_range = (0, int(bounds['Total Budget (BUDGET)'][1]))
 
 # Excess Budget per Student filter using sliders
 if 'Excess Budget per Student' in selected_options:
     excess_budget_range = st.sidebar.slider("School's Excess Budget per Student Range:", key='excess_budget',
-                                        min_value=float(data['Excess Budget per Student'].min()), 
-                                        max_value=float(data['Excess Budget per Student'].max()), 
-                                        value=(float(data['Excess Budget per Student'].min()), float(data['Excess Budget per Student'].max())),format='$%d')
+                                        min_value=float(bounds['Excess Budget per Student'][0]), 
+                                        max_value=float(bounds['Excess Budget per Student'][1]), 
+                                        value=(float(bounds['Excess Budget per Student'][0]), float(bounds['Excess Budget per Student'][1])),format='$%d')
 else:
-    excess_budget_range = (float(data['Excess Budget per Student'].min()), float(data['Excess Budget per Student'].max()))
+    excess_budget_range = (float(bounds['Excess Budget per Student'][0]), float(bounds['Excess Budget per Student'][1]))
 
 # Budget Efficiency filter using sliders
 if 'Budget Efficiency' in selected_options:
     budget_efficiency_range = st.sidebar.slider("School's Budget per Student Range:", key='budget_efficiency',
-                                            min_value=float(data['Budget Efficiency'].min()), 
-                                            max_value=float(data['Budget Efficiency'].max()), 
-                                            value=(float(data['Budget Efficiency'].min()), float(data['Budget Efficiency'].max())),format='$%d')
+                                            min_value=float(bounds['Budget Efficiency'][0]), 
+                                            max_value=float(bounds['Budget Efficiency'][1]), 
+                                            value=(float(bounds['Budget Efficiency'][0]), float(bounds['Budget Efficiency'][1])),format='$%d')
 else:
-    budget_efficiency_range = (float(data['Budget Efficiency'].min()), float(data['Budget Efficiency'].max()))
+    budget_efficiency_range = (float(bounds['Budget Efficiency'][0]), float(bounds['Budget Efficiency'][1]))
 
 
 # Disadvantage Score filter using sliders
 if 'Disadvantage Score' in selected_options:
     disadvantage_score_range = st.sidebar.slider("School's Disadvantage Score Range:", key='disadvantage_score', 
                                              min_value=0.0, 
-                                             max_value=float(data['Disadvantage Score'].max()), 
-                                             value=(0.0, float(data['Disadvantage Score'].max())))
+                                             max_value=float(bounds['Disadvantage Score'][1]), 
+                                             value=(0.0, float(bounds['Disadvantage Score'][1])))
 else:
-    disadvantage_score_range = (0.0, float(data['Disadvantage Score'].max()))
+    disadvantage_score_range = (0.0, float(bounds['Disadvantage Score'][1]))
 
 
 # Distance to nearest school using sliders
 if 'Distance to Closest School' in selected_options:
     distance_range = st.sidebar.slider("School's Distance to Closest School Range:", key='distance',
                                      min_value=0.0, 
-                                     max_value=float(data['Distance to Closest School (miles)'].max()), 
-                                     value=(0.0, float(data['Distance to Closest School (miles)'].max())))
+                                     max_value=float(bounds['Distance to Closest School (miles)'][1]), 
+                                     value=(0.0, float(bounds['Distance to Closest School (miles)'][1])))
 else:
-    distance_range = (0.0, float(data['Distance to Closest School (miles)'].max()))
+    distance_range = (0.0, float(bounds['Distance to Closest School (miles)'][1]))
+
 
+# Schools with at least some number of other schools within a radius, counted live on
+# the spatial index rather than read from the precomputed closest-school column
+nearby_mask = None
+if 'Schools Within Distance' in selected_options:
+    radius = st.sidebar.slider('Miles to Other Schools:', min_value=0.25, max_value=3.0, value=1.0, step=0.25, key='nearby_radius')
+    nearby_count = st.sidebar.number_input(f'Other Schools Within {radius:g} Miles (at least):', min_value=1, value=1, step=1, key='nearby_count')
+    with profile.stage('nearby'):
+        neighbours = school_index(checksum).within(radius)
+        nearby_mask = np.array([len(found) for found in neighbours]) >= nearby_count
 
-# Total AAFTE Enrollment range filter using sliders
 if 'Enrollment Total' in selected_options:
     enrollment_range = st.sidebar.slider("School's total Enrollment Range:", key='enrollment_range',
                                      min_value=0, 
-                                     max_value=int(data['Total AAFTE* Enrollment (ENROLLMENT)'].max()), 
+                                     max_value=int(bounds['Total AAFTE* Enrollment (ENROLLMENT)'][1]), 
                                      value=(0,0),format='%i')
 else:
-    enrollment_range = (0, int(data['Total AAFTE* Enrollment (ENROLLMENT)'].max()))
+    enrollment_range = (0, int(bounds['Total AAFTE* Enrollment (ENROLLMENT)'][1]))
 
 if 'Building Capacity' in selected_options:
     capacity_range = st.sidebar.slider("School's Capacity Range:", key='building_capacity',
                                      min_value=0, 
-                                     max_value=int(data['Capacity'].max()), 
+                                     max_value=int(bounds['Capacity'][1]), 
                                      value=(0, 300),format='%i')
 else:
-    capacity_range = (0, int(data['Capacity'].max()))
+    capacity_range = (0, int(bounds['Capacity'][1]))
 
 # School Capacity range filter using sliders
 if 'Capacity Total' in selected_options:
     capacity = st.sidebar.slider("School's Capacity Percent Range:", key='capacity',
                                      min_value=0.0, 
-                                     max_value=float(data['Capacity Percent'].max()*100.0), 
+                                     max_value=float(bounds['Capacity Percent'][1]*100.0), 
                                      value=(0.0, 65.0), format='%i%%')
     capacity = tuple(element / 100.0 for element in capacity)
 else:
-    capacity = (0.0, float(data['Capacity Percent'].max()))
+    capacity = (0.0, float(bounds['Capacity Percent'][1]))
 
 # Building Condition Score filter using sliders
 if 'Building Condition Score' in selected_options:
     building_condition_score = st.sidebar.slider("School's Building Condition Score Range:", key='building_condition_score', 
                                      min_value=0.0, 
-                                     max_value=float(data['Building Condition Score'].max()), 
-                                     value=(0.0, float(data['Building Condition Score'].max())))
+                                     max_value=float(bounds['Building Condition Score'][1]), 
+                                     value=(0.0, float(bounds['Building Condition Score'][1])))
 else:
-    building_condition_score = (0.0, float(data['Building Condition Score'].max()))
+    building_condition_score = (0.0, float(bounds['Building Condition Score'][1]))
 
 if 'School Type' in selected_options:
-    school_type = st.sidebar.multiselect('Select School Type', data['Use'].unique(), default=data['Use'].unique(), key='school_type', placeholder='No School Types Selected')
+    school_type = st.sidebar.multiselect('Select School Type', index.unique['Use'], default=index.unique['Use'], key='school_type', placeholder='No School Types Selected')
 else:
-    school_type = data['Use'].unique()
+    school_type = index.unique['Use']
+
+# Schools in the same k-means cluster as the schools picked, on a notebook feature set or
+# a custom one. Features and labels for every k are cached per feature set, so only the
+# first use of a feature set fits anything.
+similar_mask = None
+if 'Similar Schools' in selected_options:
+    similar_to = st.sidebar.multiselect('Schools Similar To:', index.unique['School'], key='similar_to', placeholder='No Schools Selected')
+    cluster_set = st.sidebar.selectbox('Compare Schools On:', [*FEATURE_SETS, 'Custom'], key='cluster_set',
+                                       format_func=lambda name: FEATURE_SET_NAMES.get(name, 'Custom features'))
+    if cluster_set == 'Custom':
+        cluster_columns = st.sidebar.multiselect('Features:', FEATURE_COLUMNS, default=FEATURE_SETS['B'], key='cluster_columns')
+    else:
+        cluster_columns = FEATURE_SETS[cluster_set]
+    cluster_count = st.sidebar.slider('Number of Clusters:', min(CLUSTER_COUNTS), max(CLUSTER_COUNTS), 4, key='cluster_count')
+    if cluster_columns:
+        with profile.stage('clusters'):
+            labels = school_clusters(checksum, tuple(cluster_columns), tuple(FEATURE_WEIGHTS.get(cluster_set, {}).items()))[cluster_count]
+            similar_mask = similar_schools(labels, np.flatnonzero(index.isin_mask('School', similar_to)))
+    else:
+        # Nothing to compare on, so no school counts as similar
+        st.sidebar.warning('Pick at least one feature to compare schools on.')
+        similar_mask = np.zeros(len(data), dtype=bool)
+
+
 
 
+def resolve_manual_schools(names, options):
+    # Names typed into the box ('MLK', 'Northgate', 'Cascadia Elementray') become the
+    # school they refer to; names picked from the list stay as they are, and names that
+    # match no school in the data are dropped and listed
+    chosen = st.session_state['manual_school']
+    resolved = names.resolve_within(chosen, options)
+    st.session_state['manual_school'] = list(dict.fromkeys(school for school in resolved if school in options))
+    st.session_state['unmatched_schools'] = [name for name, school in zip(chosen, resolved) if school not in options]
 
 
-manual_school = st.sidebar.multiselect('Manually Select Additional Schools to Close:', data['School'].unique(), key='manual_school', placeholder='No Manual Schools Selected')
+manual_school = st.sidebar.multiselect('Manually Select Additional Schools to Close:', index.unique['School'], key='manual_school', placeholder='No Manual Schools Selected',
+                                       accept_new_options=True, on_change=resolve_manual_schools,
+                                       args=(school_names(checksum), list(index.unique['School'])))
+if st.session_state.get('unmatched_schools'):
+    st.sidebar.warning(f"No school found for: {', '.join(st.session_state.pop('unmatched_schools'))}")
+
+# Optional capacity limit on the schools receiving students: overflow goes to the closed
+# school's next-best schools instead of pushing a school past the cap
+constrained = st.sidebar.checkbox('Limit receiving schools to a capacity cap', key='constrained')
+max_capacity = st.sidebar.slider('Capacity Cap (% of Building Capacity):', 50, 150, 100, step=5, key='max_capacity',
+                                 disabled=not constrained) / 100
 
 
 if 'manual_school' not in st.session_state:
@@ -233,39 +243,39 @@ if 'manual_school' not in st.session_state:
 if 'selected_landmark' not in st.session_state:
     st.session_state['selected_landmark'] = []
 if 'budget_range' not in st.session_state:
-    st.session_state['budget_range'] = (0, int(data['Total Budget (BUDGET)'].max()))
+    st.session_state['budget_range'] = (0, int(bounds['Total Budget (BUDGET)'][1]))
 if 'excess_budget_range' not in st.session_state:
-    st.session_state['excess_budget_range'] = (float(data['Excess Budget per Student'].min()), float(data['Excess Budget per Student'].max()))
+    st.session_state['excess_budget_range'] = (float(bounds['Excess Budget per Student'][0]), float(bounds['Excess Budget per Student'][1]))
 if 'budget_efficiency_range' not in st.session_state:
-    st.session_state['budget_efficiency_range'] = (float(data['Budget Efficiency'].min()), float(data['Budget Efficiency'].max()))
+    st.session_state['budget_efficiency_range'] = (float(bounds['Budget Efficiency'][0]), float(bounds['Budget Efficiency'][1]))
 if 'disadvantage_score_range' not in st.session_state:
-    st.session_state['disadvantage_score_range'] = (0.0, float(data['Disadvantage Score'].max()))
+    st.session_state['disadvantage_score_range'] = (0.0, float(bounds['Disadvantage Score'][1]))
 if 'distance_range' not in st.session_state:
-    st.session_state['distance_range'] = (0.0, float(data['Distance to Closest School (miles)'].max()))
+    st.session_state['distance_range'] = (0.0, float(bounds['Distance to Closest School (miles)'][1]))
 if 'enrollment_range' not in st.session_state:
-    st.session_state['enrollment_range'] = (0, int(data['Total AAFTE* Enrollment (ENROLLMENT)'].max()))
+    st.session_state['enrollment_range'] = (0, int(bounds['Total AAFTE* Enrollment (ENROLLMENT)'][1]))
 if 'capacity' not in st.session_state:
-    st.session_state['capacity'] = (0.0, float(data['Capacity Percent'].max()))
+    st.session_state['capacity'] = (0.0, float(bounds['Capacity Percent'][1]))
 if 'building_condition_score' not in st.session_state:
-    st.session_state['building_condition_score'] = (0.0, float(data['Building Condition Score'].max()))
+    st.session_state['building_condition_score'] = (0.0, float(bounds['Building Condition Score'][1]))
 if 'school_type' not in st.session_state:
     st.session_state['school_type'] = ['K-12','E','K-8']
 if 'building_capacity' not in st.session_state:
-    st.session_state['building_capacity'] = (0, int(data['Capacity'].max()))
+    st.session_state['building_capacity'] = (0, int(bounds['Capacity'][1]))
 
 def reset_all_states():
     st.session_state.manual_school = []
     st.session_state.selected_landmark = ['Y','N','P']
-    st.session_state.budget_range = (0, int(data['Total Budget (BUDGET)'].max()))
-    st.session_state.excess_budget_range = (float(data['Excess Budget per Student'].min()), float(data['Excess Budget per Student'].max()))
-    st.session_state.budget_efficiency_range = (float(data['Budget Efficiency'].min()), float(data['Budget Efficiency'].max()))
-    st.session_state.disadvantage_score_range = (0.0, float(data['Disadvantage Score'].max()))
-    st.session_state.distance_range = (0.0, float(data['Distance to Closest School (miles)'].max()))
-    st.session_state.enrollment_range = (0, int(data['Total AAFTE* Enrollment (ENROLLMENT)'].max()))
-    st.session_state.capacity = (0.0, float(data['Capacity Percent'].max()))
-    st.session_state.building_condition_score = (0.0, float(data['Building Condition Score'].max()))
+    st.session_state.budget_range = (0, int(bounds['Total Budget (BUDGET)'][1]))
+    st.session_state.excess_budget_range = (float(bounds['Excess Budget per Student'][0]), float(bounds['Excess Budget per Student'][1]))
+    st.session_state.budget_efficiency_range = (float(bounds['Budget Efficiency'][0]), float(bounds['Budget Efficiency'][1]))
+    st.session_state.disadvantage_score_range = (0.0, float(bounds['Disadvantage Score'][1]))
+    st.session_state.distance_range = (0.0, float(bounds['Distance to Closest School (miles)'][1]))
+    st.session_state.enrollment_range = (0, int(bounds['Total AAFTE* Enrollment (ENROLLMENT)'][1]))
+    st.session_state.capacity = (0.0, float(bounds['Capacity Percent'][1]))
+    st.session_state.building_condition_score = (0.0, float(bounds['Building Condition Score'][1]))
     st.session_state.school_type = ['E','K-12','K-8']
-    st.session_state.building_capacity = (0, int(data['Capacity'].max()))
+    st.session_state.building_capacity = (0, int(bounds['Capacity'][1]))
 
                                                  
 
@@ -280,7 +290,7 @@ def set_example_1():
 
 def set_example_2():
     reset_all_states()
-    st.session_state.enrollment_range = (0, int(data['Total AAFTE* Enrollment (ENROLLMENT)'].max()))
+    st.session_state.enrollment_range = (0, int(bounds['Total AAFTE* Enrollment (ENROLLMENT)'][1]))
     st.session_state.capacity = (0, 65)
     st.session_state.building_condition_score = (3, 5)
     st.session_state.selected_options = ['Capacity Total', 'Building Condition Score']
@@ -302,16 +312,14 @@ def set_example_4():
 def set_proposed_option_a():
     reset_all_states()
     st.session_state.enrollment_range = (0, 0)
-    st.session_state.manual_school = ['Licton Springs/Webster', 'Monroe/Salmon Bay','North Beach Elementary', 'Broadview-Thomson','Green Lake Elementary','Decatur Elementary','Sacajawea Elementary','Cedar Park Elementary','Laurelhurst Elementary','Catharine Blaine K-8','John Hay Elementary',
-                        'McGilvra Elementary', 'Stevens Elementary', 'TOPS/Seward', 'Orca/Whitworth', 'Graham Hill Elementary', 'Dunlap Elementary', 'Rainier View Elementary', 'Lafayette Elementary', 'Louisa Boren (STEM)', 'Sanislo Elementary']
+    st.session_state.manual_school = list(PROPOSED_OPTION_A)
     st.session_state.selected_options = ['Enrollment Total']
     
 
 def set_proposed_option_b():
     reset_all_states()
     st.session_state.enrollment_range = (0, 0)
-    st.session_state.manual_school = ['Licton Springs/Webster','North Beach Elementary','Broadview-Thomson', 'Green Lake Elementary','Decatur Elementary','Cedar Park Elementary','Laurelhurst Elementary', 'Catharine Blaine K-8','John Hay Elementary', 'McGilvra Elementary','Stevens Elementary',
-                        'Thurgood Marshall Elementary', 'Orca/Whitworth', 'Graham Hill Elementary', 'Rainier View Elementary', 'Louisa Boren (STEM)', 'Sanislo Elementary']
+    st.session_state.manual_school = list(PROPOSED_OPTION_B)
     st.session_state.selected_options = ['Enrollment Total']
 
 
@@ -338,31 +346,25 @@ st.sidebar.write("<h5>School type is K-8 or E, Building Capacity and Enrollment
 l3 = st.sidebar.button('Load Example 4', key='example_4', on_click=set_example_4)
 
 
-# Apply filters
-filtered_data = data[((data['Landmark'].isin(selected_landmark)) &
-                     (data['Total Budget (BUDGET)'] >= budget_range[0]) & 
-                     (data['Total Budget (BUDGET)'] <= budget_range[1]) & 
-                     (data['Excess Budget per Student'] >= excess_budget_range[0]) &
-                     (data['Excess Budget per Student'] <= excess_budget_range[1]) &
-                     #(data['Budget Efficiency'] >= budget_efficiency_range[0]) &
-                     #(data['Budget Efficiency'] <= budget_efficiency_range[1]) &
-                    (data['Distance to Closest School (miles)'] >= distance_range[0]) &
-                    (data['Distance to Closest School (miles)'] <= distance_range[1]) &
-                     (data['Disadvantage Score'] >= disadvantage_score_range[0]) &
-                     (data['Disadvantage Score'] <= disadvantage_score_range[1]) &
-                     (data['Total AAFTE* Enrollment (ENROLLMENT)'] >= enrollment_range[0]) & 
-                     (data['Total AAFTE* Enrollment (ENROLLMENT)'] <= enrollment_range[1]) & 
-                     (data['Capacity Percent'] >= capacity[0]) & 
-                     (data['Capacity Percent'] <= capacity[1]) &
-                     (data['Capacity'] >= capacity_range[0]) &
-                     (data['Capacity'] <= capacity_range[1]) &
-                     (data['Building Condition Score'] >= building_condition_score[0]) &
-                     (data['Building Condition Score'] <= building_condition_score[1]) &
-                    
-                        (data['Use'].isin(school_type))
-                     ) |
-                     (data['School'].isin(manual_school)) 
-]
+# Apply filters, each predicate's mask is cached by the filter index
+with profile.stage('filters'):
+    filter_mask = index.mask(
+        {'Total Budget (BUDGET)': budget_range,
+         'Excess Budget per Student': excess_budget_range,
+         #'Budget Efficiency': budget_efficiency_range,
+         'Distance to Closest School (miles)': distance_range,
+         'Disadvantage Score': disadvantage_score_range,
+         'Total AAFTE* Enrollment (ENROLLMENT)': enrollment_range,
+         'Capacity Percent': capacity,
+         'Capacity': capacity_range,
+         'Building Condition Score': building_condition_score},
+        {'Landmark': selected_landmark,
+         'Use': school_type})
+    if similar_mask is not None:
+        filter_mask &= similar_mask
+    if nearby_mask is not None:
+        filter_mask &= nearby_mask
+    filtered_data = data[filter_mask | index.isin_mask('School', manual_school)]
 
 
 
@@ -370,259 +372,314 @@ filtered_data = data[((data['Landmark'].isin(selected_landmark)) &
 # Main panel
 
 
-before = reallocate_student_counts(counts, matrix, [])
+before = counts
 closed_schools = pd.array(filtered_data.index)
-after = reallocate_student_counts(counts, matrix, closed_schools)
-data['Enrollment from Redistribution'] = (after-before).astype(int)
-data['Total Enrollment'] = (data['Total AAFTE* Enrollment (ENROLLMENT)'] + data['Enrollment from Redistribution']).astype(int)
-data['Redistribution Capacity'] = (data['Total Enrollment'] / data['Capacity']).astype(float)
+# Repeat closure sets come from the in-memory cache, then from the scenario store shared
+# across processes and restarts (presets are solved into it at startup). Otherwise keep
+# the solved closure set per session so toggling a school only updates what it touches.
+profile.count('closed_schools', len(closed_schools))
+closed_mask = data.index.isin(filtered_data.index)
+solved = False
+with profile.stage('redistribution'):
+    if st.session_state.get('simulation_checksum') != checksum:
+        st.session_state['simulation'] = SimulationState(counts, matrix)
+        st.session_state['simulation_checksum'] = checksum
+        st.session_state.pop('simulation_view', None)
+    cache_key = (checksum, frozenset(closed_schools))
+    if constrained:
+        cache_key += ('constrained', max_capacity)
+    cached = redistribution_cache.get(cache_key)
+    if cached is None and constrained:
+        with profile.stage('constrained'):
+            result = constrained_redistribution(counts, matrix, data['Capacity'], closed_schools, data['latitude'], data['longitude'],
+                                                max_capacity, index=school_index(checksum))
+        cached = (result.counts, result.stranded, result)
+        redistribution_cache.put(cache_key, cached)
+        profile.count('solver', 'constrained')
+        profile.count('solver_iterations', result.iterations)
+    if cached is None:
+        stored = store.get(checksum, closed_mask)
+        if stored is not None:
+            cached = stored
+            redistribution_cache.put(cache_key, cached)
+            profile.count('solver', 'store')
+            profile.count('solver_iterations', 0)
+    if cached is None:
+        solved = True
+        simulation = st.session_state['simulation']
+        after = simulation.update(closed_schools)
+        stranded = simulation.stranded
+        redistribution_cache.put(cache_key, (after.copy(), stranded.copy()))
+        profile.count('solver', 'full' if simulation.toggles is None else f'{simulation.toggles} toggles')
+        profile.count('solver_iterations', simulation.iterations)
+    else:
+        after, stranded = cached[:2]
+        profile.counters.setdefault('solver', 'cached')
+        profile.counters.setdefault('solver_iterations', 0)
+
+# Keep the URL pointing at the current closure set, so it can be shared as is
+permalink = encode_scenario(checksum, closed_mask)
+if closed_mask.any() and st.query_params.get(QUERY_PARAM) != permalink:
+    st.query_params[QUERY_PARAM] = permalink
+elif not closed_mask.any() and QUERY_PARAM in st.query_params:
+    del st.query_params[QUERY_PARAM]
+# Columns, capacity buckets and map features derived from the session's SimulationState
+# are kept with its version. After a few toggles only the schools in simulation.changed
+# are recomputed; any other solve derives them for every school.
+simulation = st.session_state['simulation']
+view = st.session_state.get('simulation_view')
+incremental = solved and simulation.toggles is not None and view is not None and view['version'] == simulation.version - 1
+changed_rows = np.flatnonzero(simulation.changed) if incremental else None
+previous = view if incremental else {}
+with profile.stage('delta_columns'):
+    columns = redistribution_columns(data, before, after, changed_rows, previous.get('columns'))
+    data = apply_redistribution(data, before, after, columns)
+if solved:
+    view = st.session_state['simulation_view'] = {'version': simulation.version, 'columns': columns}
 
 st.title('Simulation of School Closures in Seattle Public Schools 2025+')
 #st.write('Seattle Public Schools (SPS) has initiated a program dubbed as <a href="https://www.seattleschools.org/resources/well-resourced-schools/">Well-Resourced Schools</a>, which began upon board approval for analysis of up to 20 elementary schools to be closed in Seattle. The hope is to close a growing budget gap in excess of $100M/year and increasing from years 2026+. This analysis utilizes <a href="https://github.com/chrislydick/sps-budget-analysis/tree/main/data">publicly available data</a> in order to understand outcomes of potential school closures. This data and analysis is provided for informational purposes only and is not intended to be a recommendation for or against any specific school closure. All code and data is available on <a href="https://github.com/chrislydick/sps-budget-analysis">GitHub here</a>.', unsafe_allow_html=True)
 st.write('Seattle Public Schools (SPS) has launched the <a href="https://www.seattleschools.org/resources/well-resourced-schools/">Well-Resourced Schools program</a> following board approval to analyze the potential closure of up to 20 elementary schools in Seattle. This initiative aims to address a budget shortfall exceeding $100 million annually, projected to increase from 2026 onward. The analysis <a href="https://github.com/chrislydick/sps-budget-analysis/tree/main/data">leverages publicly available data from SPS</a> to assess the potential outcomes of school closures. The data and analysis are provided for informational purposes only and do not constitute recommendations for or against any specific school closure. All code and data can be accessed <a href="https://github.com/chrislydick/sps-budget-analysis">here</a>. Author Information <a href="https://chrislydick.com">here</a>. Contribute to the project <a href="https://github.com/chrislydick/sps-budget-analysis/tree/main">here</a>. FAQ available <a href="https://github.com/chrislydick/sps-budget-analysis?tab=readme-ov-file#faq">here</a>. ', unsafe_allow_html=True)
 st.write('Start by selecting some number of metrics, or adjusting the metrics already selected on the left. You can also explore some pre-loaded examples. ', unsafe_allow_html=True)
 st.write("")
-col1, col2, col3, col4, col5 = st.columns(5)
+if stranded.sum() > 0:
+    stranded_schools = data.loc[stranded > 0, 'School']
+    st.warning(f"{stranded.sum():,.0f} students have no open school to be redistributed to and are not counted in the capacities below, nor is their cost counted as saved: {', '.join(stranded_schools)}")
+if constrained and closed_mask.any():
+    result = cached[2]
+    st.caption(f"Capacity capped at {max_capacity:.0%}: {result.spilled:,.0f} students moved off their proportional share to the next-best schools, "
+               f"{result.over_capacity:,.0f} still over the cap where every nearby school is full. "
+               f"Solved in {result.seconds * 1000:,.1f} ms, {result.iterations} iterations.")
+col1, col2, col3, col4, col5, col6 = st.columns(6)
 #col2, col3, col4, col5 = st.columns(4)
 
 
-s_under_75 = len(data[data['Redistribution Capacity'] < 0.75]) - len(filtered_data)
-s_under_75_delta = -1+len(data[data['Redistribution Capacity'] < 0.75])-len(data[data['Capacity Percent'] < 0.75])
-# First calculate number of schools which went into this category, then out. 
-
-
-
-data['delta < 75'] = np.where(  
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) < 75) &\
-                                (round(100*data['Redistribution Capacity'],0) == 0),\
-                                'out','')
-
-data['delta < 75'] = np.where(  
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) <= 75) & \
-                                (round(100*data['Redistribution Capacity'],0) >= 75), \
-                                'out', data['delta < 75'])
-
-
-
-
-
-data['delta 75-100'] = np.where(
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) >= 75) & \
-                                (round(100*data['Capacity Percent'],0) <= 100) & \
-                                (round(100*data['Redistribution Capacity'],0) == 0), \
-                                'out','')
-
-data['delta 75-100'] = np.where(
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) >= 75) & \
-                                (round(100*data['Capacity Percent'],0) <= 100) & \
-                                (round(100*data['Redistribution Capacity'],0) > 100), \
-                                'out',data['delta 75-100'])
-
-data['delta 75-100'] = np.where(
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) >= 75) & \
-                                (round(100*data['Capacity Percent'],0) <= 100) & \
-                                (round(100*data['Redistribution Capacity'],0) <= 75), \
-                                'out',data['delta 75-100'])
-
-data['delta 75-100'] = np.where(
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) <= 75) & \
-                                (round(100*data['Redistribution Capacity'],0) >= 75) & \
-                                (round(100*data['Redistribution Capacity'],0) <= 100), \
-                                'in',data['delta 75-100'])
-
-
-
-data['delta > 100'] = np.where(
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) >= 100) & \
-                                (round(100*data['Redistribution Capacity'],0) == 0),\
-                                'out','')
-
-data['delta > 100'] = np.where(
-                                (round(100*data['Redistribution Capacity'],0) != round(100*data['Capacity Percent'],0)) & \
-                                (round(100*data['Capacity Percent'],0) <= 100) & \
-                                (round(100*data['Redistribution Capacity'],0) > 100),\
-                                'in',data['delta > 100'])
-
-data['delta closed'] = np.where((data['Redistribution Capacity'] == 0), 'in','')
-
-
-s_over_100 = len(data[data['Redistribution Capacity'] > 1.0])
-s_over_100_delta = len(data[data['Redistribution Capacity'] > 1.0])-len(data[data['Capacity Percent'] > 1.0])
-s_remaining = len(data) - s_over_100 - s_under_75 - len(filtered_data)
-#s_remaining_delta = abs(s_over_100 - s_under_75)
-# 
-s_remaining_delta = -1 + (len(data.query('`Capacity Percent` >= 0.75 & `Capacity Percent` <= 1.0')))\
-                    - len(data.query('`Redistribution Capacity` >= 0.75 & `Redistribution Capacity` <= 1.0 ')) - len(filtered_data)
-
-if filtered_data['Total AAFTE* Enrollment (ENROLLMENT)'].sum() == 0:
-    col1.metric("Students' Assignments Unchanged*", f"{data['Total AAFTE* Enrollment (ENROLLMENT)'].sum() - filtered_data['Total AAFTE* Enrollment (ENROLLMENT)'].sum():,.0f}", delta=f"{filtered_data['Total AAFTE* Enrollment (ENROLLMENT)'].sum():,.0f}", delta_color="off")
-else: 
-    col1.metric("Students' Assignments Unchanged*", f"{data['Total AAFTE* Enrollment (ENROLLMENT)'].sum() - filtered_data['Total AAFTE* Enrollment (ENROLLMENT)'].sum():,.0f}", delta=f"-{filtered_data['Total AAFTE* Enrollment (ENROLLMENT)'].sum():,.0f}")
-
-if len(data[data['delta closed']=='in']) == 0:
-    col2.metric('Schools Remaining Open', f"{len(data) - len(filtered_data)}", delta=f"{-len(data[data['delta closed']=='in'])}", delta_color="off")
-else: 
-    col2.metric('Schools Remaining Open', f"{len(data) - len(filtered_data)}", delta=f"{-len(data[data['delta closed']=='in'])}", delta_color="inverse")
-if len(data[data['delta < 75']=='in'])-len(data[data['delta < 75']=='out']) == 0:
-    col3.metric('Schools Under 75% Capacity', f"{s_under_75}", delta=f"{len(data[data['delta < 75']=='in'])-len(data[data['delta < 75']=='out'])}", delta_color="off")
-else: 
-    col3.metric('Schools Under 75% Capacity', f"{s_under_75}", delta=f"{len(data[data['delta < 75']=='in'])-len(data[data['delta < 75']=='out'])}", delta_color="inverse")
-
-if len(data[data['delta 75-100']=='in'])-len(data[data['delta 75-100']=='out']) == 0:
-    col4.metric('Schools Between 75-100% Capacity', f"{s_remaining}", delta=f"{len(data[data['delta 75-100']=='in'])-len(data[data['delta 75-100']=='out'])}", delta_color="off")
-else: 
-    col4.metric('Schools Between 75-100% Capacity', f"{s_remaining}", delta=f"{len(data[data['delta 75-100']=='in'])-len(data[data['delta 75-100']=='out'])}", delta_color="normal")
-
-if len(data[data['delta > 100']=='in'])-len(data[data['delta > 100']=='out']) == 0:
-    col5.metric('Schools Over 100% Capacity', f"{s_over_100}", delta=f"{len(data[data['delta > 100']=='in'])-len(data[data['delta > 100']=='out'])}", delta_color="off")
+# Bin every school's capacity before and after once, and feed all of the tiles from
+# the resulting bucket-to-bucket transition counts
+with profile.stage('capacity_buckets'):
+    bucket_before = classify(data['Capacity Percent'], thresholds=capacity_thresholds)
+    if incremental:
+        bucket_after = previous['buckets'].copy()
+        bucket_after[changed_rows] = classify(columns['Redistribution Capacity'][changed_rows], closed_mask[changed_rows], capacity_thresholds)
+    else:
+        bucket_after = classify(data['Redistribution Capacity'], closed_mask, thresholds=capacity_thresholds)
+    if solved:
+        view['buckets'] = bucket_after
+    transitions = transition_matrix(bucket_before, bucket_after)
+    tile_values, tile_deltas = bucket_tiles(transitions)
+    names = bucket_names(capacity_thresholds)
+    data['Capacity Change'] = np.where(bucket_before == bucket_after, '', np.array(names)[bucket_before] + ' -> ' + np.array(names)[bucket_after])
+
+displaced = filtered_data['Total AAFTE* Enrollment (ENROLLMENT)'].sum()
+if displaced == 0:
+    col1.metric("Students' Assignments Unchanged*", f"{data['Total AAFTE* Enrollment (ENROLLMENT)'].sum() - displaced:,.0f}", delta=f"{displaced:,.0f}", delta_color="off")
 else: 
-    col5.metric('Schools Over 100% Capacity', f"{s_over_100}", delta=f"{len(data[data['delta > 100']=='in'])-len(data[data['delta > 100']=='out'])}", delta_color="inverse")
-
-
-#col2.metric('Schools Remaining Open', f"{len(data) - len(filtered_data)}", delta=f"-{len(filtered_data)}", delta_color="inverse")
-#col3.metric('Schools Under 75% Capacity', f"{s_under_75}", delta=f"{s_under_75_delta}", delta_color="inverse")
-#col4.metric('Schools Between 75-100% Capacity', f"{s_remaining}", delta=f"{s_remaining_delta}")
-#col5.metric('Schools Over 100% Capacity', f"{s_over_100}", delta=f"{s_over_100_delta}", delta_color="inverse")
-
-
-
-
-#identify all column names beginning with 'Cluster_'
-cluster_columns = [col for col in data.columns if 'Cluster_' in col]
-data_editor_data = filtered_data.drop(columns=cluster_columns)
-data_moved = move_column(data_editor_data, 'Use', 1)
-data_moved = move_column(data_moved, 'Total AAFTE* Enrollment (ENROLLMENT)', 2)
-data_moved = move_column(data_moved, 'Capacity', 3)
-data_moved = move_column(data_moved, 'Capacity Percent', 4)
-data_moved['Capacity Percent'] = data_moved['Capacity Percent'].map(lambda x: f"{x*100:.4}").astype(float)
-data_moved.rename(columns={'Total AAFTE* Enrollment (ENROLLMENT)':'Enrollment'}, inplace=True)
-
-data_editor_data_1 = data.drop(columns=cluster_columns)
-data_moved_1 = move_column(data_editor_data_1, 'Use', 1)
-data_moved_1['Ending Excess Capacity'] = data_moved_1['Capacity'] - data_moved_1['Total Enrollment']
-data_moved_1 = move_column(data_moved_1, 'Total AAFTE* Enrollment (ENROLLMENT)', 2)
-data_moved_1 = move_column(data_moved_1, 'Enrollment from Redistribution', 3)
-data_moved_1 = move_column(data_moved_1, 'Total Enrollment', 4)
-data_moved_1 = move_column(data_moved_1, 'Capacity', 5)
-data_moved_1 = move_column(data_moved_1, 'Ending Excess Capacity', 6)
-data_moved_1 = move_column(data_moved_1, 'Capacity Percent', 7)
-data_moved_1 = move_column(data_moved_1, 'Redistribution Capacity', 8)
-data_moved_1['Redistribution Capacity'] = data_moved_1['Redistribution Capacity'].map(lambda x: f"{x*100:.4}").astype(float)
-data_moved_1['Capacity Percent'] = data_moved_1['Capacity Percent'].map(lambda x: f"{x*100:.4}").astype(float)
-data_moved_1.rename(columns={'Capacity':'Building Capacity','Excess Capacity':'Beginning Excess Capacity','Total AAFTE* Enrollment (ENROLLMENT)':'Beginning Enrollment','Capacity Percent':'Beginning Capacity %', 'Redistribution Capacity':'Ending Capacity %', 'Enrollment from Redistribution':'Additional Students'}, inplace=True)
-data_moved_1 = data_moved_1[data_moved_1['Additional Students'] > 0]
-data_moved_1['Ending Capacity %'] = data_moved_1['Ending Capacity %'].astype(int)
-
+    col1.metric("Students' Assignments Unchanged*", f"{data['Total AAFTE* Enrollment (ENROLLMENT)'].sum() - displaced:,.0f}", delta=f"-{displaced:,.0f}")
+
+low, high = (f"{t*100:.0f}" for t in capacity_thresholds)
+tiles = [(col2, 'Schools Remaining Open', 'inverse'),
+         (col3, f"Schools Under {low}% Capacity", 'inverse'),
+         (col4, f"Schools Between {low}-{high}% Capacity", 'normal'),
+         (col5, f"Schools Over {high}% Capacity", 'inverse')]
+for (column, label, delta_color), value, delta in zip(tiles, tile_values, tile_deltas):
+    column.metric(label, f"{value}", delta=f"{delta}", delta_color=delta_color if delta != 0 else "off")
+
+# Net budget impact: building costs of the closed schools, plus per-student costs where
+# students leave less where they arrive, from the coefficients fit once per data version.
+# Uses the redistributed counts before the whole-student truncation shown in the tables,
+# and stranded students still cost what they did.
+savings = net_savings(cost_model(checksum), closed_mask, counts, after, stranded)
+col6.metric('Estimated Annual Savings', f"${savings / 1e6:,.1f}M",
+            help='Building costs of the closed schools from the WRS update, plus the budget per student regressed on '
+                 '2021-23 school budgets for students leaving, less the same for students absorbed by open schools.')
+
+if solved:
+    store.put(checksum, closed_mask, after, stranded)
+
+# Optional Monte Carlo bands: the redistribution weights are resampled from the student
+# counts they were built from, and each school's outcome is reported as a 5th-95th
+# percentile range, cached per closure set like the point estimate
+bands = None
+if st.checkbox('Show uncertainty ranges for the redistribution (2,000 simulations)', key='uncertainty') and closed_mask.any():
+    bands_key = (checksum, frozenset(closed_schools), 'bands')
+    with profile.stage('uncertainty'):
+        bands = redistribution_cache.get(bands_key)
+        if bands is None:
+            bands = simulate(counts, matrix, closed_mask, data['Capacity'], totals=sampling_totals(checksum))
+            redistribution_cache.put(bands_key, bands)
+
+
+
+
+# Maps and tables are in expanders that only run while open. They start open, so the
+# page looks as before, but closing one skips its work (and its imports) on every rerun.
+# The optional views below them are fragments: ticking one reruns only that view.
+maps_section = st.expander('Maps of School Capacity', expanded=True, key='maps_section', on_change='rerun')
+tables_section = st.expander('Schools Closing and Schools Impacted', expanded=True, key='tables_section', on_change='rerun')
 
 # Map of school locations with different colors for filtered and non-filtered schools
-col1a, col2a = st.columns(2)
-
-# Create a map centered around Seattle with a dark base map
-#try: 
-#    m = folium.Map(location=[filtered_data['latitude'].mean(), filtered_data['longitude'].mean()], zoom_start=11, tiles='CartoDB dark_matter')
-#except:
-#    m = folium.Map(location=[data['latitude'].mean(), data['longitude'].mean()], zoom_start=11, tiles='CartoDB dark_matter')
-
-m = folium.Map(location=[data['latitude'].mean(), data['longitude'].mean()], zoom_start=11, tiles='CartoDB dark_matter')
-n = folium.Map(location=[data['latitude'].mean(), data['longitude'].mean()], zoom_start=11, tiles='CartoDB dark_matter')
-
-
-#low_range_color = st.selectbox('Capacity Low Range Color (< 75%)', color_options, index=color_options.index('lightgreen'))
-low_range_color = 'lightblue'
-#mid_range_color = st.selectbox('Capacity Mid Range Color (75% - 95%)', color_options, index=color_options.index('green'))
-mid_range_color = 'blue'
-#high_range_color = st.selectbox('Capacity High Range Color (> 95%)', color_options, index=color_options.index('darkgreen'))
-high_range_color = 'darkblue'
-#closed_school_color = st.selectbox('Closed School Color', color_options, index=color_options.index('black'))
-closed_school_color = 'red'
-
-
-
-# Add all schools to the map with different colors
-try:
-    for _, row in data.iterrows():
-        color = determine_color(row['Capacity Percent'])
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            popup=f"{row['School']} ({row['Capacity Percent']*100:.0f}%)",
-            icon=folium.Icon(icon='None',color=color)
-        ).add_to(n)
-    for _, row in data.iterrows():
-        color = closed_school_color if row['School'] in filtered_data['School'].values else determine_color(row['Redistribution Capacity'])
-        icon = folium.Icon(icon='None', color=color) if row['Enrollment from Redistribution'] == 0 else folium.Icon(color=color)
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            popup=f"{row['School']} ({row['Capacity Percent']*100:.0f}% -> {row['Redistribution Capacity']*100:.0f}%)",
-            #icon=folium.Icon(icon='none', color='blue', icon_color='white'),
-            icon=icon
-        ).add_to(m)
-except:
-    st.write("")
-
-# Before School Closures
-with col1a:
-    try: 
+if maps_section.open:
+    from streamlit_folium import st_folium
+    from maps import base_map, before_layer, after_features, after_layer
+
+    # Base maps and the 'before' layer only depend on the data, so they are built once per
+    # session. Each rerun only rebuilds the 'after' layer, as a single GeoJSON layer.
+    # A map that fails to build is logged with its traceback and replaced by an error
+    # message, rather than leaving an empty column.
+    with profile.stage('map_layers'):
+        if st.session_state.get('maps_checksum') != checksum:
+            st.session_state['before_map'] = base_map(data)
+            st.session_state['after_map'] = base_map(data)
+            st.session_state['before_layer'] = before_layer(data)
+            st.session_state['maps_checksum'] = checksum
+
+        try:
+            if bands is None:
+                features = after_features(data, closed_mask, rows=changed_rows, previous=previous.get('features'))
+                if solved:
+                    view['features'] = features
+            else:
+                features = after_features(data, closed_mask, bands)
+            after_schools = after_layer(data, closed_mask, features=features)
+        except Exception as error:
+            profile.error('map_layers', error)
+            after_schools = None
+
+    col1a, col2a = maps_section.columns(2)
+
+    # Before School Closures
+    with col1a:
         st.subheader('Capacity Before School Closure(s)')
         st.write('* Ligher Schools are of less capacity. \n * Darker Schools have higher capacity.')
-        st_folium(n, width=700, height=500) 
-    except:
-        st.write("")
-
-
-
-# After School Closures
-with col2a: 
-    try: 
+        with profile.stage('before_map'):
+            try:
+                st_folium(st.session_state['before_map'], key='before_map', feature_group_to_add=st.session_state['before_layer'], returned_objects=[], width=700, height=500)
+            except Exception as error:
+                profile.error('before_map', error)
+                st.error('The map of schools before closures could not be drawn.')
+
+    # After School Closures
+    with col2a:
         st.subheader('Capacity After School Closure(s)')
-        st.write('* Red Schools are simulated to close. \n * Schools marked: (i) have changed their capacity due to redistribution.')
-        st_folium(m, width=700, height=500) 
-    except:
-        st.write("")
-# Plotting
-        
-
-st.write(f'By closing the following {data_moved.shape[0]} schools...')
-st.data_editor(data_moved, use_container_width=True, hide_index=True, width=10000)
-
-st.write(f'You impact these {data_moved_1.shape[0]} schools...')
-st.data_editor(data_moved_1, use_container_width=True, hide_index=True, width=10000)
-###st.subheader('Budget Efficiency Distribution')
-fig, ax = plt.subplots()
-ax.hist(filtered_data['Budget Efficiency'], bins=20, color='#FF4B4B', edgecolor='black')
-ax.set_facecolor('#0B0B0BFF')
-ax.set_title('Distribution of Budget Efficiency of Schools')
-ax.set_xlabel('Budget Efficiency (Budget per Student)')
-ax.set_ylabel('Number of Schools')
-###st.pyplot(fig)
-
-# Scatter plot of two selected dimensions
-###st.subheader('2D Scatter Plot of Selected Dimensions')
-
-# Dropdown menus for selecting dimensions
-#x_dimension = st.selectbox('Select X Dimension', options=data.columns, index=data.columns.get_loc('Total Budget (BUDGET)'))
-#y_dimension = st.selectbox('Select Y Dimension', options=data.columns, index=data.columns.get_loc('Budget Efficiency'))
-
-# Create scatter plot
-#fig, ax = plt.subplots()
-#ax.scatter(data[x_dimension], data[y_dimension], color='gray', edgecolor='black', alpha=0.5, label='Not in Filter')
-#ax.scatter(filtered_data[x_dimension], filtered_data[y_dimension], color='salmon', edgecolor='black', label='In Filter')
-#ax.set_title(f'Scatter Plot of {x_dimension} vs {y_dimension}')
-#ax.set_xlabel(x_dimension)
-#ax.set_ylabel(y_dimension)
-#ax.legend()
-###st.pyplot(fig)
-
-if st.checkbox('Show All Schools and All Data'):
-    data['Capacity Percent'] = data['Capacity Percent'].map(lambda x: float(f"{x*100.0:2.1f}"))
-    data['Redistribution Capacity'] = data['Redistribution Capacity'].map(lambda x: float(f"{x*100.0:2.1f}"))
-    st.dataframe(data)
-    #st.dataframe(data[['School','Use','Total Budget (BUDGET)','Total AAFTE* Enrollment (ENROLLMENT)','Enrollment from Redistribution','Total Enrollment','Capacity','Capacity Percent','Redistribution Capacity']].rename(columns={'Total AAFTE* Enrollment (ENROLLMENT)':'Enrollment', 'Capacity Percent':'Starting Capacity Percent','Redistribution Capacity':'Ending Capacity Percent','Capacity':'Building Capacity'}), width=10000)
-
-st.write('<br><br>*<em> Enrollment & Capacity values were normalized for K-8 and K-12 schools so numbers are comparable with Elementary.</em>', unsafe_allow_html=True)
\ No newline at end of file
+        st.write('* Red Schools are simulated to close. \n * Schools outlined in white have changed their capacity due to redistribution.')
+        with profile.stage('after_map'):
+            try:
+                if after_schools is None:
+                    raise ValueError('the school layer could not be built')
+                st_folium(st.session_state['after_map'], key='after_map', feature_group_to_add=after_schools, returned_objects=[], width=700, height=500)
+            except Exception as error:
+                profile.error('after_map', error)
+                st.error('The map of schools after closures could not be drawn.')
+
+
+# Tables of the schools closing and of the schools receiving their students. Percent
+# columns are left as numbers and formatted by the table itself.
+if tables_section.open:
+    with profile.stage('tables'):
+        data_moved = closing_schools_table(filtered_data)
+
+        # Closest school that stays open, computed live from the spatial index for this closure set
+        closest_open = school_index(checksum).closest(exclude=closed_mask).loc[filtered_data.index]
+        data_moved.insert(5, 'Closest Open School', closest_open['Closest School'].values)
+        data_moved.insert(6, 'Distance to Closest Open School (miles)', closest_open['Distance to Closest School (miles)'].values)
+
+        data_moved_1 = impacted_schools_table(data)
+        if bands is not None:
+            rows = data_moved_1.index
+            low, high = bands.enrollment[0][rows].astype(int).astype(str), bands.enrollment[-1][rows].astype(int).astype(str)
+            data_moved_1.insert(9, 'Ending Enrollment Range (5-95%)', np.char.add(np.char.add(low, ' - '), high))
+            low, high = (bands.capacity[0][rows] * 100).astype(int).astype(str), (bands.capacity[-1][rows] * 100).astype(int).astype(str)
+            data_moved_1.insert(10, 'Ending Capacity % Range (5-95%)', np.char.add(np.char.add(low, ' - '), high))
+            data_moved_1.insert(11, 'Chance Over 100%', (bands.p_over[rows] * 100).round().astype(int))
+
+    with profile.stage('render_tables'):
+        table_formats = {column: st.column_config.NumberColumn(format=number_format) for column, number_format in TABLE_FORMATS.items()}
+        tables_section.write(f'By closing the following {data_moved.shape[0]} schools...')
+        tables_section.data_editor(data_moved, hide_index=True, width='stretch', column_config=table_formats)
+
+        tables_section.write(f'You impact these {data_moved_1.shape[0]} schools...')
+        tables_section.data_editor(data_moved_1, hide_index=True, width='stretch', column_config=table_formats)
+
+
+@contextmanager
+def fragment_profile(name):
+    # Stages of a fragment go into the run's profile during a full rerun. When the
+    # fragment reruns on its own, that profile was logged by the run that drew it, so
+    # the fragment times and logs its own.
+    if not profile.logged:
+        yield profile
+        return
+    own = RunProfile(st.session_state['session_id'], fragment=name, checksum=checksum)
+    yield own
+    own.log()
+
+
+@st.fragment
+def marginal_view(data, closed_schools, closed_mask):
+    # Optional ranking of the schools still open by what closing each one as well would do,
+    # all evaluated in one batch and cached per closure set
+    if st.checkbox('Rank the impact of closing each remaining school', key='marginal'):
+        with fragment_profile('marginal') as run, run.stage('marginal'):
+            marginal_key = (checksum, frozenset(closed_schools), 'marginal')
+            marginal = redistribution_cache.get(marginal_key)
+            if marginal is None:
+                marginal = marginal_impact(counts, matrix, data['Capacity'], closed_mask, data['School'], cost_model(checksum),
+                                           capacity_thresholds)
+                redistribution_cache.put(marginal_key, marginal)
+            st.write(f'Closing one more of the {len(marginal)} open schools, on top of the current selection')
+            st.dataframe(marginal.sort_values('Budget Freed', ascending=False), hide_index=True, width='stretch',
+                         column_config={'Budget Freed': st.column_config.NumberColumn('Budget Freed', format='dollar'),
+                                        'Worst Receiving Capacity %': st.column_config.NumberColumn(format='%.1f%%')})
+
+
+@st.fragment
+def projection_view(data, closed_schools, closed_mask):
+    # Optional projection: each school's enrollment follows its 2021-2024 trend, and the
+    # closures are applied to every year from 2025 to 2030 in one solve, cached per closure set
+    if st.checkbox('Project enrollment and capacity through 2025-2030', key='projection'):
+        with fragment_profile('projection') as run, run.stage('projection'):
+            projection_key = (checksum, frozenset(closed_schools), 'projection')
+            projection = redistribution_cache.get(projection_key)
+            if projection is None:
+                projection = project_closures(counts, matrix, data['Capacity'], enrollment_trends(checksum), closed_schools)
+                redistribution_cache.put(projection_key, projection)
+            st.write('Projected schools by capacity after the closures, if every school keeps its recent enrollment trend')
+            st.dataframe(projection_summary(projection, closed_mask, capacity_thresholds), width='stretch')
+            impacted = data.index[data['Enrollment from Redistribution'].to_numpy() > 0]
+            capacity_by_year = pd.DataFrame(projection.capacity_percent[:, impacted].T * 100,
+                                            columns=[str(year) for year in projection.years])
+            capacity_by_year.insert(0, 'School', data.loc[impacted, 'School'].values)
+            capacity_by_year['Trend'] = list(capacity_by_year[[str(year) for year in projection.years]].to_numpy())
+            st.write('Redistribution Capacity (%) of the impacted schools by year')
+            st.dataframe(capacity_by_year, hide_index=True, width='stretch',
+                         column_config={**{str(year): st.column_config.NumberColumn(format='%.1f') for year in projection.years},
+                                        'Trend': st.column_config.LineChartColumn('Trend', y_min=0)})
+
+
+@st.fragment
+def all_data_view(data):
+    if st.checkbox('Show All Schools and All Data', key='all_data'):
+        with fragment_profile('all_data') as run, run.stage('all_data'):
+            st.dataframe(data.assign(**{'Capacity Percent': data['Capacity Percent'] * 100,
+                                    'Redistribution Capacity': data['Redistribution Capacity'] * 100}),
+                     column_config={'Capacity Percent': st.column_config.NumberColumn(format='%.1f'),
+                                    'Redistribution Capacity': st.column_config.NumberColumn(format='%.1f')})
+
+
+marginal_view(data, closed_schools, closed_mask)
+projection_view(data, closed_schools, closed_mask)
+all_data_view(data)
+
+st.write('<br><br>*<em> Enrollment & Capacity values were normalized for K-8 and K-12 schools so numbers are comparable with Elementary.</em>', unsafe_allow_html=True)
+
+
+# Performance panel, only with ?debug in the URL. Timings cover everything above.
+if debug:
+    with st.sidebar.expander('Performance', expanded=True):
+        st.write(f"Total: {profile.total_ms():,.1f} ms, solver: {profile.counters['solver']}, "
+                 f"iterations: {profile.counters['solver_iterations']}, closed schools: {profile.counters['closed_schools']}")
+        st.dataframe(pd.DataFrame(profile.table()), hide_index=True)
+        for failure in profile.errors:
+            st.write(f"{failure['stage']}: {failure['error']}")
+profile.context['checksum'] = checksum
+profile.log()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_district
+from capacity_buckets import bucket_tiles, classify, transition_matrix
+from engine import apply_redistribution
+from filters import FilterIndex
+from maps import after_layer, base_map
+from redistribution import reallocate_student_counts
+from tables import closing_schools_table, impacted_schools_table
+
+
+# Run from the repository root:  python -m benchmarks.run [--compare benchmarks/baseline.json]
+SIZES = (73, 500, 2000, 10000)
+CLOSED_SHARES = (0.01, 0.15, 0.48, 1.0)   # 0.48 of 73 schools is 35 closures
+BASELINE = 'benchmarks/baseline.json'
+
+
+def timeit(function, min_time=0.2, max_repeats=50):
+    # Median seconds per call, repeating until min_time has passed
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_repeats and (len(times) < 3 or time.perf_counter() - start < min_time):
+        call_start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - call_start)
+    return float(np.median(times)), len(times)
+
+
+def closure_counts(num_schools):
+    return sorted({max(1, round(share * num_schools)) for share in CLOSED_SHARES})
+
+
+def bench_size(num_schools, rng, max_map_size):
+    data, matrix = synthetic_district(num_schools, seed=num_schools)
+    counts = data['Total AAFTE* Enrollment (ENROLLMENT)'].to_numpy(dtype=float)
+    results = []
+
+    def record(path, seconds_repeats, closures=None):
+        seconds, repeats = seconds_repeats
+        results.append({'path': path, 'schools': num_schools, 'closures': closures,
+                        'ms': round(seconds * 1000, 4), 'repeats': repeats})
+
+    for num_closed in closure_counts(num_schools):
+        closed = rng.choice(num_schools, num_closed, replace=False)
+        record('reallocate_student_counts', timeit(lambda: reallocate_student_counts(counts, matrix, closed)), num_closed)
+        if num_schools <= 2000:
+            dense = matrix.toarray()
+            record('reallocate_student_counts (dense)', timeit(lambda: reallocate_student_counts(counts, dense, closed)), num_closed)
+
+    # Everything after the solve, for a typical closure set
+    closed = np.zeros(num_schools, dtype=bool)
+    closed[rng.choice(num_schools, max(1, round(0.15 * num_schools)), replace=False)] = True
+    after = reallocate_student_counts(counts, matrix, np.flatnonzero(closed))
+    closed_data = apply_redistribution(data, counts, after)
+
+    # A fresh set of slider ranges each call, so the cached masks are never reused
+    index = FilterIndex(data)
+    columns = ['Total Budget (BUDGET)', 'Capacity Percent', 'Distance to Closest School (miles)', 'Total AAFTE* Enrollment (ENROLLMENT)']
+    def filter_mask():
+        ranges = {column: tuple(np.sort(rng.uniform(*index.bounds[column], 2))) for column in columns}
+        return index.mask(ranges, {'Landmark': ['N', 'P'], 'Use': ['E', 'K-8']})
+    record('filter_mask', timeit(filter_mask))
+
+    def buckets():
+        before = classify(closed_data['Capacity Percent'])
+        return bucket_tiles(transition_matrix(before, classify(closed_data['Redistribution Capacity'], closed)))
+    record('capacity_buckets', timeit(buckets))
+
+    record('table_shaping', timeit(lambda: (closing_schools_table(closed_data[closed]), impacted_schools_table(closed_data))))
+
+    if num_schools <= max_map_size:
+        def folium_map():
+            folium_map = base_map(closed_data)
+            after_layer(closed_data, closed).add_to(folium_map)
+            return folium_map.get_root().render()
+        record('folium_map', timeit(folium_map, max_repeats=10))
+    return results
+
+
+# Cold start and reruns of the Streamlit app on the real data, run in a fresh interpreter
+# so the app's own imports and data loading are part of the first run. Streamlit itself
+# is imported before the clock starts, since every deployment pays for it anyway.
+APP_BENCH = '''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+def timed(path, run):
+    start = time.perf_counter()
+    run()
+    assert not at.exception, [e.value for e in at.exception]
+    results.append({'path': path, 'schools': None, 'closures': None, 'ms': round((time.perf_counter() - start) * 1000, 1), 'repeats': 1})
+
+results = []
+at = AppTest.from_file('app.py', default_timeout=120)
+timed('app_cold_start', at.run)
+timed('app_rerun', at.run)
+timed('app_load_option_a', at.button(key='example_a').click().run)
+timed('app_slider', lambda: at.slider(key='enrollment_range').set_range(0, 250).run())
+for key in ('all_data', 'marginal', 'projection'):
+    timed(f'app_show_{key}', at.checkbox(key=key).check().run)
+    timed(f'app_hide_{key}', at.checkbox(key=key).uncheck().run)
+# The map and table expanders closed, as a user skimming the metric tiles would have them
+at.session_state['maps_section'] = at.session_state['tables_section'] = False
+timed('app_rerun_sections_closed', at.run)
+timed('app_slider_sections_closed', lambda: at.slider(key='enrollment_range').set_range(0, 300).run())
+json.dump(results, sys.stdout)
+'''
+
+
+def bench_app(repeats=3):
+    # Median of each app path over separate interpreters
+    runs = [json.loads(subprocess.run([sys.executable, '-c', APP_BENCH], capture_output=True, text=True, check=True).stdout)
+            for _ in range(repeats)]
+    return [dict(paths[0], ms=float(np.median([r['ms'] for r in paths])), repeats=repeats) for paths in zip(*runs)]
+
+
+def compare(results, baseline, tolerance, min_delta_ms=0.5):
+    # Paths slower than the baseline by more than the tolerance ratio. Differences under
+    # min_delta_ms are timer and scheduler noise, not regressions.
+    previous = {(r['path'], r['schools'], r['closures']): r['ms'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['path'], result['schools'], result['closures']))
+        if before:
+            result['baseline_ms'] = before
+            result['ratio'] = round(result['ms'] / before, 3)
+            if result['ratio'] > tolerance and result['ms'] - before > min_delta_ms:
+                regressions.append(result)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the simulation and UI hot paths on synthetic districts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--max-map-size', type=int, default=2000, help='largest district to build the folium map for')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON to compare against; exits with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown ratio counted as a regression')
+    parser.add_argument('--min-delta', type=float, default=0.5, help='smallest slowdown in ms counted as a regression')
+    parser.add_argument('--app', action='store_true', help='also time the app cold start and reruns on the real data')
+    parser.add_argument('--app-repeats', type=int, default=3, help='fresh interpreters to take the app timings from')
+    parser.add_argument('--save-baseline', action='store_true', help=f'write the results to {BASELINE}')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    for num_schools in args.sizes:
+        results.extend(bench_size(num_schools, rng, args.max_map_size))
+    if args.app:
+        results.extend(bench_app(args.app_repeats))
+
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+              'machine': platform.machine(), 'results': results}
+    regressions = compare(results, json.load(open(args.compare)), args.tolerance, args.min_delta) if args.compare else []
+
+    print(f"{'path':<36}{'schools':>8}{'closures':>9}{'ms':>11}{'baseline':>11}")
+    for r in results:
+        baseline = f"{r['baseline_ms']:.3f}" if 'baseline_ms' in r else ''
+        print(f"{r['path']:<36}{r['schools'] or '':>8}{r['closures'] or '':>9}{r['ms']:>11.3f}{baseline:>11}")
+
+    for path in filter(None, [args.output, BASELINE if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+    if regressions:
+        print(f"\n{len(regressions)} regressions over {args.tolerance}x:")
+        for r in regressions:
+            print(f"  {r['path']} ({r['schools']} schools, {r['closures'] or '-'} closures): {r['baseline_ms']:.3f} -> {r['ms']:.3f} ms")
+        sys.exit(1)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from geo import SchoolIndex
+
+
+# Seattle's schools cover about 0.3 x 0.2 degrees; larger districts spread over a wider
+# area so the density of schools stays about the same
+CENTER = (47.61, -122.33)
+
+
+def synthetic_district(num_schools, neighbours=12, seed=0):
+    # A district shaped like performance_data_2023.csv with num_schools schools, and its
+    # redistribution matrix. Each school sends its students to its nearest schools in
+    # proportion to closeness, with some share leaving the district as in the real rows.
+    rng = np.random.default_rng(seed)
+    spread = np.sqrt(num_schools / 73)
+    latitude = CENTER[0] + rng.normal(0, 0.07 * spread, num_schools)
+    longitude = CENTER[1] + rng.normal(0, 0.05 * spread, num_schools)
+    index = SchoolIndex(latitude, longitude, np.array([f'School {i}' for i in range(num_schools)]))
+
+    distances, nearest = index.nearest(min(neighbours, num_schools - 1))
+    weights = 1.0 / (distances + 0.1)
+    weights *= rng.uniform(0.85, 1.0, (num_schools, 1)) / weights.sum(axis=1, keepdims=True)
+    matrix = sparse.csr_matrix((weights.ravel(), nearest.ravel(), np.arange(0, nearest.size + 1, nearest.shape[1])),
+                               shape=(num_schools, num_schools))
+
+    enrollment = rng.integers(150, 650, num_schools)
+    capacity = np.maximum(enrollment * rng.uniform(0.6, 1.6, num_schools), 100).astype(int)
+    budget = enrollment * rng.normal(11000, 2000, num_schools)
+    closest = index.closest()
+    data = pd.DataFrame({
+        'School': index.names,
+        'Total Budget (BUDGET)': budget.astype(int),
+        'Total AAFTE* Enrollment (ENROLLMENT)': enrollment,
+        'latitude': latitude,
+        'longitude': longitude,
+        'Closest School': closest['Closest School'],
+        'Distance to Closest School (miles)': closest['Distance to Closest School (miles)'],
+        'Budget Efficiency': budget / enrollment,
+        'Use': rng.choice(['E', 'K-8', 'K-12'], num_schools, p=[0.8, 0.15, 0.05]),
+        'Landmark': rng.choice(['N', 'Y', 'P'], num_schools, p=[0.8, 0.15, 0.05]),
+        'Disadvantage Score': rng.uniform(0, 1.2, num_schools),
+        'Excess Budget per Student': rng.normal(0, 2000, num_schools).astype(int),
+        'Capacity': capacity,
+        'Excess Capacity': capacity - enrollment,
+        'Capacity Percent': enrollment / capacity,
+        'Building Condition Score': rng.uniform(0, 4, num_schools).round(2),
+        'Building Condition': rng.choice(['0. None', '1: Poor', '2: Good', '3: Excellent'], num_schools),
+    })
+    for k in range(3, 7):
+        data[f'Cluster_{k}a'] = rng.integers(0, k, num_schools)
+    data['Enrollment from Redistribution'] = 0
+    data['Redistribution Capacity'] = data['Capacity Percent']
+    data['Total Enrollment'] = data['Total AAFTE* Enrollment (ENROLLMENT)']
+    return data, matrix
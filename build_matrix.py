@@ -0,0 +1,140 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from names import load_fact_schools, name_index
+
+
+FACT_SCHOOLS = 'data/fact_schools.csv'
+ATTENDING_LIVE = 'data/fact_student_attending_live.csv'
+LIVE_ATTENDING = 'data/fact_student_live_attending.csv'
+SCHOOLS = 'data/performance_data_2023.csv'
+MATRIX_CSV = 'data/redistribution_matrix.csv'
+MATRIX_NPZ = 'data/redistribution_matrix.npz'
+
+
+def map_names(table, fact_schools, column):
+    # Replace the names in 'column' with the primary school name; names not in fact_schools become NaN.
+    # A join rather than names.NameIndex.resolve: fact_schools.csv lists 'Olympic Hills' and
+    # 'Olympic View' twice, and the notebook's matrix counts those students once per listing.
+    return pd.merge(table, fact_schools[['Text', 'School']].rename(columns={'School': '_School'}),
+                    left_on=column, right_on='Text', how='left')\
+        .drop(columns=[column, 'Text']).rename(columns={'_School': column})
+
+
+def student_flows(attending_live, live_attending, fact_schools):
+    # Students leaving each school if it closes, as (From, To, Count) rows. Same rules as
+    # the notebook's redistribute_students_vector, for every school at once:
+    #   * students attending From who live elsewhere go back to where they live
+    #   * students living in From's area and attending From are split in proportion to
+    #     where the rest of From's area already attends
+    attending_live = map_names(map_names(attending_live, fact_schools, 'Attending School'), fact_schools, 'Live Location')
+    live_attending = map_names(map_names(live_attending, fact_schools, 'Attendance Area'), fact_schools, 'School')
+
+    stay = attending_live['Attending School'] == attending_live['Live Location']
+    local = attending_live[stay].drop_duplicates('Attending School').set_index('Attending School')['Count']
+
+    leaving = attending_live[~stay & attending_live['Attending School'].notna()]\
+        .rename(columns={'Attending School': 'From', 'Live Location': 'To'})[['From', 'To', 'Count']]
+
+    elsewhere = live_attending[(live_attending['Attendance Area'] != live_attending['School']) & live_attending['Attendance Area'].notna()]
+    area_total = elsewhere.groupby('Attendance Area')['Count'].transform('sum')
+    # Schools with no students living and attending locally still spread one student's worth of weight
+    local_count = elsewhere['Attendance Area'].map(local).fillna(1)
+    neighbours = pd.DataFrame({'From': elsewhere['Attendance Area'], 'To': elsewhere['School'],
+                               'Count': elsewhere['Count'] / area_total * local_count})
+
+    flows = pd.concat([leaving, neighbours], ignore_index=True).dropna(subset=['To'])
+    return flows.groupby(['From', 'To'], sort=False)['Count'].sum().reset_index()
+
+
+def build_matrix(schools, flows, names):
+    # Row-normalized weights from each school to every school in 'schools', as CSR arrays.
+    # Rows are normalized over all destinations, including schools outside 'schools', then
+    # only the columns in 'schools' are kept, so a row can sum to less than 1. 'names' is
+    # a names.NameIndex for the primary names of 'schools'.
+    position = pd.Series(np.arange(len(schools)), index=schools)
+    totals = flows.groupby('From')['Count'].sum()
+    flows = flows.assign(Weight=flows['Count'] / flows['From'].map(totals))
+
+    rows = names.resolve(pd.Series(schools)).to_numpy()
+    row_of = pd.Series(np.arange(len(schools)), index=rows)
+    row_of = row_of[row_of.index.notna() & ~row_of.index.duplicated()]
+    flows = flows[flows['From'].isin(row_of.index) & flows['To'].isin(position.index)]
+
+    row = row_of.loc[flows['From']].to_numpy()
+    column = position.loc[flows['To']].to_numpy()
+    order = np.lexsort((column, row))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(row, minlength=len(schools)))])
+    # 'totals' keeps the number of students behind each row's weights, for resampling them
+    return {'data': flows['Weight'].to_numpy()[order], 'indices': column[order].astype(np.int32),
+            'indptr': indptr.astype(np.int32), 'shape': np.array([len(schools), len(schools)]),
+            'schools': np.asarray(schools, dtype=str), 'totals': pd.Series(rows).map(totals).fillna(0).to_numpy()}
+
+
+def to_dense(matrix):
+    dense = np.zeros(tuple(matrix['shape']))
+    rows = np.repeat(np.arange(len(matrix['indptr']) - 1), np.diff(matrix['indptr']))
+    dense[rows, matrix['indices']] = matrix['data']
+    return dense
+
+
+def validate(matrix, flows):
+    # Every stored weight is a share of its row's students, so rows can't sum past 1, and
+    # each row keeps exactly the share of its students that go to schools in the matrix
+    dense = to_dense(matrix)
+    row_sums = dense.sum(axis=1)
+    if (dense < 0).any() or (row_sums > 1 + 1e-9).any():
+        raise ValueError('redistribution weights must be non-negative and each row must sum to at most 1')
+    in_matrix = flows['To'].isin(matrix['schools'])
+    kept = flows[in_matrix].groupby('From')['Count'].sum() / flows.groupby('From')['Count'].sum()
+    expected = pd.Series(matrix['schools']).map(kept).fillna(0).to_numpy()
+    differs = ~np.isclose(row_sums, expected) & (expected > 0)
+    if differs.any():
+        raise ValueError(f"row sums differ from the attendance tables for {list(matrix['schools'][differs])}")
+    return row_sums
+
+
+def save_matrix(matrix, path=MATRIX_NPZ):
+    np.savez_compressed(path, **matrix)
+
+
+def load_matrix(path=MATRIX_NPZ):
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the school-to-school redistribution matrix from the attendance fact tables.')
+    parser.add_argument('--schools', default=SCHOOLS, help="CSV whose 'School' column gives the matrix's rows and columns, in order")
+    parser.add_argument('--output', default=MATRIX_NPZ)
+    parser.add_argument('--csv', help='also write the dense matrix in the old CSV layout')
+    parser.add_argument('--compare', default=MATRIX_CSV, help='existing dense CSV to check the new matrix against')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    names = name_index(FACT_SCHOOLS)
+    schools = pd.read_csv(args.schools)['School'].to_numpy()
+    attending_live, live_attending = pd.read_csv(ATTENDING_LIVE), pd.read_csv(LIVE_ATTENDING)
+    fact_schools = load_fact_schools(FACT_SCHOOLS)
+    flows = student_flows(attending_live, live_attending, fact_schools)
+    matrix = build_matrix(schools, flows, names)
+    validate(matrix, flows)
+    save_matrix(matrix, args.output)
+    print(f"{len(schools)} schools, {len(matrix['data'])} non-zero weights -> {args.output} in {time.perf_counter() - start:.3f} s")
+    # The flows are joined on exact spellings by map_names, so report the names that join
+    # misses, with the name index's closest alias as a hint
+    exact = fact_schools.drop_duplicates('Text').set_index('Text')['School']
+    unmatched = names.unmatched({'Attending School': attending_live['Attending School'], 'Live Location': attending_live['Live Location'],
+                                 'Attendance Area': live_attending['Attendance Area'], 'School': live_attending['School']},
+                                resolve=lambda values: values.map(exact))
+    if len(unmatched):
+        print(f"School names that matched no school, left out of the flows:\n{unmatched.to_string(index=False)}")
+
+    if args.csv:
+        pd.DataFrame(to_dense(matrix)).to_csv(args.csv)
+    if args.compare:
+        difference = np.abs(to_dense(matrix) - pd.read_csv(args.compare, index_col=0).to_numpy()).max()
+        print(f"Largest difference from {args.compare}: {difference:.2e}")
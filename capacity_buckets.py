@@ -0,0 +1,46 @@
+import numpy as np
+
+
+UNDER, BETWEEN, OVER, CLOSED = range(4)
+NUM_BUCKETS = 4
+
+
+def bucket_names(thresholds=(0.75, 1.0)):
+    low, high = (f"{t*100:.0f}" for t in thresholds)
+    return [f"< {low}%", f"{low}-{high}%", f"> {high}%", 'Closed']
+
+
+def classify(capacity_percent, closed=None, thresholds=(0.75, 1.0)):
+    # Bucket index for each school: under the low threshold, between the thresholds
+    # (inclusive), over the high threshold, or closed. Works on a single vector of
+    # schools or a (scenarios x schools) array.
+    capacity_percent = np.asarray(capacity_percent, dtype=float)
+    low, high = thresholds
+    buckets = (capacity_percent >= low).astype(np.int8) + (capacity_percent > high)
+    if closed is not None:
+        buckets = np.where(closed, CLOSED, buckets).astype(np.int8)
+    return buckets
+
+
+def transition_matrix(before, after):
+    # Counts of schools moving from each bucket (rows) to each bucket (columns). A 2-D
+    # 'after' gives one matrix per scenario; 'before' is broadcast against it.
+    before, after = np.broadcast_arrays(np.asarray(before), np.asarray(after))
+    pairs = before.astype(np.intp) * NUM_BUCKETS + after
+    if pairs.ndim == 1:
+        return np.bincount(pairs, minlength=NUM_BUCKETS ** 2).reshape(NUM_BUCKETS, NUM_BUCKETS)
+    offsets = np.arange(len(pairs))[:, None] * NUM_BUCKETS ** 2
+    counts = np.bincount((pairs + offsets).ravel(), minlength=len(pairs) * NUM_BUCKETS ** 2)
+    return counts.reshape(len(pairs), NUM_BUCKETS, NUM_BUCKETS)
+
+
+def bucket_tiles(transitions):
+    # Schools remaining open, then the number of schools in each capacity bucket after
+    # the closures, each with its change from before. Last axis: [open, under, between, over].
+    before = transitions.sum(axis=-1)
+    after = transitions.sum(axis=-2)
+    total = after.sum(axis=-1)
+    values = np.stack([total - after[..., CLOSED], after[..., UNDER], after[..., BETWEEN], after[..., OVER]], axis=-1)
+    deltas = np.stack([-after[..., CLOSED], after[..., UNDER] - before[..., UNDER],
+                       after[..., BETWEEN] - before[..., BETWEEN], after[..., OVER] - before[..., OVER]], axis=-1)
+    return values, deltas
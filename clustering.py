@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+# Feature sets of the notebook's clustering analyses A, B and C. C is B's columns with
+# budget efficiency and distance to the closest school weighted up.
+FEATURE_SETS = {
+    'A': ['Bilingual Education (BUDGET)', 'General Education (BUDGET)', 'Other Grants (BUDGET)', 'Special Education (BUDGET)',
+          'State LAP (BUDGET)', 'Total Budget (BUDGET)', 'Bilingual Education (ENROLLMENT)', 'Free and Reduced Lunch (ENROLLMENT)',
+          'Special Education (ENROLLMENT)', 'Total AAFTE* Enrollment (ENROLLMENT)', 'Budget Efficiency'],
+    'B': ['General Education (BUDGET)', 'Other Grants (BUDGET)', 'Special Education (BUDGET)', 'Total Budget (BUDGET)',
+          'Federal Title I (BUDGET)', 'Bilingual Education (ENROLLMENT)', 'Free and Reduced Lunch (ENROLLMENT)',
+          'Special Education (ENROLLMENT)', 'Total AAFTE* Enrollment (ENROLLMENT)', 'Budget Efficiency',
+          'Distance to Closest School (miles)'],
+}
+FEATURE_SETS['C'] = FEATURE_SETS['B']
+FEATURE_WEIGHTS = {'C': {'Budget Efficiency': 2.0, 'Distance to Closest School (miles)': 4.0}}
+FEATURE_SET_NAMES = {'A': 'Budget and enrollment (analysis A)', 'B': 'Budget, enrollment and distance (analysis B)',
+                     'C': 'Analysis B, weighted to efficiency and distance (analysis C)'}
+# Everything a custom feature set can use
+FEATURE_COLUMNS = list(dict.fromkeys(FEATURE_SETS['A'] + FEATURE_SETS['B'] + [
+    'Capacity', 'Capacity Percent', 'Excess Budget per Student', 'Disadvantage Score', 'Building Condition Score']))
+# The notebook keeps k = 3 to 6 as Cluster_3a..Cluster_6c, and its elbow plots go up to 10
+CLUSTER_COUNTS = tuple(range(2, 11))
+RANDOM_STATE = 42
+
+# labels: {k: cluster of every row}, centers: {k: (k x features)}, inertia: {k: sum of squared distances}
+Clustering = namedtuple('Clustering', ['labels', 'centers', 'inertia'])
+
+
+def feature_matrix(data, columns, weights=None):
+    # Same preprocessing as the notebook: missing values filled with the column mean,
+    # standardized, then each column multiplied by its weight
+    values = data[list(columns)].to_numpy(dtype=float)
+    mean = np.nanmean(values, axis=0)
+    values = np.where(np.isnan(values), mean, values)
+    scale = values.std(axis=0)
+    values = (values - values.mean(axis=0)) / np.where(scale > 0, scale, 1.0)
+    weights = weights or {}
+    return values * np.array([weights.get(column, 1.0) for column in columns])
+
+
+def split_worst(features, centers, labels):
+    # k+1 starting centers from a k-means fit: the cluster with the largest sum of squared
+    # distances is replaced by two centers one standard deviation either side of it,
+    # along its principal direction
+    errors = np.bincount(labels, weights=((features - centers[labels]) ** 2).sum(axis=1), minlength=len(centers))
+    worst = errors.argmax()
+    points = features[labels == worst][:2000] - centers[worst]
+    _, spread, directions = np.linalg.svd(points, full_matrices=False)
+    offset = directions[0] * spread[0] / np.sqrt(len(points))
+    return np.vstack([np.delete(centers, worst, axis=0), centers[worst] + offset, centers[worst] - offset])
+
+
+def cluster(features, counts=CLUSTER_COUNTS, random_state=RANDOM_STATE, batch_size=1024):
+    # Mini-batch k-means for every k in counts, warm-started: the smallest k starts from
+    # k-means++, and each following k from the previous fit with its worst cluster split
+    # in two, so later fits start close to a solution. Batches of batch_size rows keep
+    # each step cheap on the multi-year extract and beyond.
+    from sklearn.cluster import MiniBatchKMeans
+
+    counts = sorted(k for k in counts if k <= len(features))
+    labels, centers, inertia = {}, {}, {}
+    init, n_init = 'k-means++', 3
+    for k in counts:
+        if centers:
+            init, assigned, n_init = centers[previous], labels[previous], 1
+            while len(init) < k:
+                init = split_worst(features, init, assigned)
+                assigned = ((features[:, None, :] - init[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        model = MiniBatchKMeans(n_clusters=k, init=init, n_init=n_init, batch_size=min(batch_size, len(features)),
+                                random_state=random_state)
+        labels[k] = model.fit_predict(features)
+        centers[k] = model.cluster_centers_
+        inertia[k] = float(model.inertia_)
+        previous = k
+    return Clustering(labels, centers, inertia)
+
+
+def similar_schools(labels, schools):
+    # Rows in the same cluster as any of the given rows, which include the given rows
+    return np.isin(labels, labels[np.asarray(schools, dtype=int)])
+
+
+if __name__ == '__main__':
+    import time
+    import pandas as pd
+
+    extract = pd.read_csv('data/sps_data_extract.csv')
+    for name, columns in FEATURE_SETS.items():
+        start = time.perf_counter()
+        features = feature_matrix(extract, columns, FEATURE_WEIGHTS.get(name))
+        result = cluster(features)
+        print(f"Analysis {name}: {len(features)} school-years, k = {min(result.labels)}-{max(result.labels)} in "
+              f"{(time.perf_counter() - start)*1000:.0f} ms, inertia " + ', '.join(f"{result.inertia[k]:,.0f}" for k in sorted(result.inertia)))
+
+    # Scaling check on the extract repeated with noise
+    rng = np.random.default_rng(0)
+    features = feature_matrix(extract, FEATURE_SETS['B'])
+    large = np.concatenate([features + rng.normal(0, 0.1, features.shape) for _ in range(500)])
+    start = time.perf_counter()
+    cluster(large)
+    print(f"{len(large):,} rows, k = 2-10 in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,137 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+from geo import SchoolIndex, haversine
+from redistribution import absorption_shares
+
+
+# Each closed school can spill students to the schools it already sends students to,
+# plus this many of its nearest open schools
+SPILL_NEIGHBOURS = 8
+
+# counts, stranded: as in RedistributionResult
+# spilled: students sent away from their proportional school because it was full
+# over_capacity: students that still ended above the cap because every candidate school was full
+# seconds, iterations, status: the LP solve's time, HiGHS iteration count and status message
+ConstrainedResult = namedtuple('ConstrainedResult', ['counts', 'stranded', 'spilled', 'over_capacity',
+                                                     'seconds', 'iterations', 'status'])
+
+
+def spill_costs(shares, closed_idx, open_idx, latitude, longitude, index, neighbours=SPILL_NEIGHBOURS):
+    # Candidate (closed row, open column, cost) arcs for overflow. A closed school's
+    # candidates are ranked by its redistribution share, then by distance, and the cost
+    # of sending a student to a candidate is its rank plus its distance as a fraction of
+    # a rank, so any higher-share school is preferred over any closer one.
+    shares = sparse.coo_matrix(shares)
+    rows, columns = shares.row, shares.col
+    if neighbours:
+        # Nearest open schools to each closed school, as positions among the open schools
+        closed = np.zeros(len(latitude), dtype=bool)
+        closed[closed_idx] = True
+        _, nearest = index.nearest(neighbours, exclude=closed)
+        nearest = nearest[closed_idx]
+        found = nearest >= 0
+        position = np.full(len(latitude), -1)
+        position[open_idx] = np.arange(len(open_idx))
+        rows = np.concatenate([rows, np.repeat(np.arange(len(closed_idx)), found.sum(axis=1))])
+        columns = np.concatenate([columns, position[nearest[found]]])
+    pairs = np.unique(np.column_stack([rows, columns]), axis=0)
+    rows, columns = pairs[:, 0], pairs[:, 1]
+
+    share = np.asarray(sparse.csr_matrix(shares)[rows, columns]).ravel()
+    distance = haversine(latitude[closed_idx[rows]], longitude[closed_idx[rows]], latitude[open_idx[columns]], longitude[open_idx[columns]])
+    order = np.lexsort((distance, -share, rows))
+    rank = np.empty(len(rows))
+    starts = np.searchsorted(rows[order], rows[order], side='left')
+    rank[order] = np.arange(len(rows)) - starts
+    return rows, columns, 1.0 + rank + distance / (distance.max() + 1.0)
+
+
+def constrained_redistribution(student_counts, redistribution_matrix, capacity, closed_schools, latitude, longitude,
+                               max_capacity=1.0, neighbours=SPILL_NEIGHBOURS, index=None):
+    # Redistribution with each open school capped at max_capacity x Capacity, as a
+    # min-cost flow solved as an LP:
+    #   * each closed school's students first follow the proportional redistribution,
+    #     at no cost, up to the amount the unconstrained solve sends to each school
+    #   * students that don't fit spill to the closed school's next-best candidates
+    #     (see spill_costs), paying that candidate's cost per student
+    #   * if every candidate is full the cap is exceeded, at a cost above any spill
+    # With room everywhere the proportional redistribution is the only zero-cost flow,
+    # so the result matches solve_redistribution.
+    from scipy.optimize import linprog
+
+    student_counts = np.asarray(student_counts, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    num_schools = len(student_counts)
+    closed = np.zeros(num_schools, dtype=bool)
+    closed[list(closed_schools)] = True
+    closed_idx, open_idx = np.flatnonzero(closed), np.flatnonzero(~closed)
+    counts = np.where(closed, 0.0, student_counts)
+    if not len(closed_idx) or not len(open_idx):
+        return ConstrainedResult(counts, np.where(closed, student_counts, 0.0), 0.0, 0.0, 0.0, 0, 'nothing to place')
+
+    shares = absorption_shares(redistribution_matrix, closed)
+    moving = student_counts[closed_idx]
+    targets = sparse.coo_matrix(sparse.diags(moving) @ sparse.csr_matrix(shares))
+    targets.data[targets.data < 1e-9] = 0.0
+    targets.eliminate_zeros()
+    placed = np.asarray(targets.sum(axis=1)).ravel()
+    index = index or SchoolIndex(latitude, longitude)
+    spill_rows, spill_columns, spill_cost = spill_costs(shares, closed_idx, open_idx, latitude, longitude, index, neighbours)
+
+    # Variables: proportional flows, spill flows, then students over each open school's cap
+    num_targets, num_spills, num_open = targets.nnz, len(spill_rows), len(open_idx)
+    cost = np.concatenate([np.zeros(num_targets), spill_cost, np.full(num_open, 10.0 * (spill_cost.max() + 1.0))])
+    flow_rows = np.concatenate([targets.row, spill_rows])
+    flow_columns = np.concatenate([targets.col, spill_columns])
+    flows = np.arange(num_targets + num_spills)
+    # Every placeable student of a closed school lands somewhere
+    A_eq = sparse.csr_matrix((np.ones(len(flows)), (flow_rows, flows)), shape=(len(closed_idx), len(cost)))
+    # Students arriving at an open school, less its overflow, fit in its headroom
+    A_ub = sparse.csr_matrix((np.concatenate([np.ones(len(flows)), -np.ones(num_open)]),
+                              (np.concatenate([flow_columns, np.arange(num_open)]), np.concatenate([flows, num_targets + num_spills + np.arange(num_open)]))),
+                             shape=(num_open, len(cost)))
+    headroom = np.maximum(max_capacity * capacity[open_idx] - student_counts[open_idx], 0.0)
+    bounds = np.column_stack([np.zeros(len(cost)), np.concatenate([targets.data, np.full(num_spills + num_open, np.inf)])])
+
+    start = time.perf_counter()
+    result = linprog(cost, A_ub=A_ub, b_ub=headroom, A_eq=A_eq, b_eq=placed, bounds=bounds, method='highs')
+    seconds = time.perf_counter() - start
+    if not result.success:
+        raise RuntimeError(f'constrained redistribution failed: {result.message}')
+
+    solution = result.x
+    arrivals = np.bincount(flow_columns, weights=solution[:num_targets + num_spills], minlength=num_open)
+    counts[open_idx] += arrivals
+    stranded = np.zeros(num_schools)
+    stranded[closed_idx] = moving - placed
+    stranded[np.abs(stranded) < 1e-9] = 0.0
+    return ConstrainedResult(counts, stranded, float(solution[num_targets:num_targets + num_spills].sum()),
+                             float(solution[num_targets + num_spills:].sum()), seconds, int(result.nit), result.message)
+
+
+if __name__ == '__main__':
+    from benchmarks.synthetic import synthetic_district
+    from data_loader import load_data
+    from presets import PROPOSED_OPTION_A
+
+    checksum, data, matrix, counts = load_data()
+    closed = np.flatnonzero(data['School'].isin(PROPOSED_OPTION_A))
+    for cap in (1.0, 0.95):
+        result = constrained_redistribution(counts, matrix, data['Capacity'], closed, data['latitude'], data['longitude'], cap)
+        over = (result.counts / data['Capacity'] > cap + 1e-9).sum()
+        print(f"Option A capped at {cap:.0%}: {result.spilled:,.0f} students spilled, {result.over_capacity:,.0f} over the cap "
+              f"({over} schools), {result.iterations} iterations in {result.seconds*1000:.1f} ms")
+
+    for num_schools in (2000, 10000):
+        data, matrix = synthetic_district(num_schools)
+        closed = np.random.default_rng(0).choice(num_schools, num_schools // 10, replace=False)
+        start = time.perf_counter()
+        result = constrained_redistribution(data['Total AAFTE* Enrollment (ENROLLMENT)'], matrix, data['Capacity'], closed,
+                                            data['latitude'], data['longitude'])
+        print(f"{num_schools} schools, {len(closed)} closed: {result.spilled:,.0f} spilled, {result.iterations} iterations, "
+              f"LP {result.seconds*1000:.0f} ms, total {(time.perf_counter() - start)*1000:.0f} ms")
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from build_matrix import load_matrix
+from clustering import cluster, feature_matrix
+from names import NameIndex, load_fact_schools
+from filters import FilterIndex
+from geo import SchoolIndex
+from projection import SPS_DATA_EXTRACT, fit_trends
+from savings import WRS_TABLE, fit_cost_model
+from store import is_current, load_store
+
+
+PERFORMANCE_DATA = 'data/performance_data_2023.csv'
+# Built from the attendance fact tables by build_matrix.py
+REDISTRIBUTION_MATRIX = 'data/redistribution_matrix.npz'
+FACT_SCHOOLS = 'data/fact_schools.csv'
+DATA_FILES = (PERFORMANCE_DATA, REDISTRIBUTION_MATRIX, SPS_DATA_EXTRACT, WRS_TABLE, FACT_SCHOOLS)
+# Up to this many schools a dense matrix is faster than scipy.sparse for any number of
+# closures (python -m benchmarks.run --sizes 200 300: dense 0.7 ms vs sparse 1.1 ms with
+# all 200 closed, but already slower at 300 schools with 144 closed, 1.3 ms vs 1.2 ms)
+DENSE_MAX_SCHOOLS = 200
+
+
+@lru_cache(maxsize=32)
+def _file_hash(path, mtime_ns, size):
+    # Only re-hashed when the file's mtime or size changes
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def data_checksum(paths=DATA_FILES):
+    # Identifies the current version of the data, so caches reload when a CSV changes
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(_file_hash(path, stat.st_mtime_ns, stat.st_size).encode())
+    return digest.hexdigest()[:16]
+
+
+def clean_performance_data(data):
+    data = data.rename(columns=lambda x: x.strip()).drop(columns=['Unnamed: 0'])
+    data['Necessary Budget'] = 500000 + data['Total Budget (BUDGET)']
+    data['Budget Efficiency'] = data['Total Budget (BUDGET)'] / data['Total AAFTE* Enrollment (ENROLLMENT)']
+    data['Landmark'] = data['Landmark'].fillna('N')
+    data['Building Condition Score'] = data['Building Condition Score'].fillna(0)
+    data['Building Condition'] = data['Building Condition'].fillna('0. None')
+    data['Landmark'] = data['Landmark'].replace({'None': 'N', 'NA': 'N', '0': 'N', 0:'N'})
+    data['Use'] = data['Use'].replace({'0':'K-12', 0:'K-12'})
+    data['Enrollment from Redistribution'] = 0
+    data['Redistribution Capacity'] = data['Capacity Percent']
+    data['Total Enrollment'] = data['Total AAFTE* Enrollment (ENROLLMENT)']
+    data.drop(columns='Year', inplace=True)
+
+    # Rename latitude and longitude columns to lowercase due to nuances with folium
+    return data.rename(columns={'Latitude': 'latitude', 'Longitude': 'longitude'})
+
+
+def _read_only(array):
+    array = np.array(array)
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=2)
+def _load(checksum):
+    # The typed store built by store.py skips parsing and cleaning the CSV; it's only
+    # used while it matches the CSV, so a stale store falls back to the slower path
+    if is_current(source=PERFORMANCE_DATA):
+        data = load_store()
+    else:
+        data = clean_performance_data(pd.read_csv(PERFORMANCE_DATA))
+    stored = load_matrix(REDISTRIBUTION_MATRIX)
+    if not np.array_equal(stored['schools'], data['School'].to_numpy(dtype=str)):
+        raise ValueError(f"{REDISTRIBUTION_MATRIX} was built for a different list of schools than {PERFORMANCE_DATA}, rebuild it with build_matrix.py")
+    matrix = sparse.csr_matrix((stored['data'], stored['indices'], stored['indptr']), shape=tuple(stored['shape']))
+    if matrix.shape[0] <= DENSE_MAX_SCHOOLS:
+        matrix = _read_only(matrix.toarray())
+    counts = _read_only(data['Total AAFTE* Enrollment (ENROLLMENT)'].values.astype(float))
+    return data, matrix, counts, _read_only(stored['totals'])
+
+
+@lru_cache(maxsize=2)
+def filter_index(checksum):
+    # Slider bounds and sorted column indexes for the sidebar filters, per data version
+    return FilterIndex(_load(checksum)[0])
+
+
+@lru_cache(maxsize=2)
+def school_index(checksum):
+    # Spatial index of the schools for live nearest-open-school queries, per data version
+    data = _load(checksum)[0]
+    return SchoolIndex(data['latitude'], data['longitude'], data['School'])
+
+
+@lru_cache(maxsize=2)
+def enrollment_trends(checksum):
+    # Annual enrollment growth per school from the multi-year extract, fit once per data version
+    return _read_only(fit_trends(pd.read_csv(SPS_DATA_EXTRACT), _load(checksum)[0]['School']))
+
+
+@lru_cache(maxsize=32)
+def cluster_features(checksum, columns, weights=()):
+    # Imputed, standardized and weighted features of every school, per data version,
+    # feature set and weighting. columns is a tuple, weights a tuple of (column, weight).
+    return _read_only(feature_matrix(_load(checksum)[0], columns, dict(weights)))
+
+
+@lru_cache(maxsize=32)
+def school_clusters(checksum, columns, weights=()):
+    # Cluster labels of every school for k = 2 to 10, from one warm-started pass and
+    # computed once per feature set and weighting
+    result = cluster(cluster_features(checksum, columns, weights))
+    return {k: _read_only(labels) for k, labels in result.labels.items()}
+
+
+@lru_cache(maxsize=2)
+def school_names(checksum):
+    # Every known spelling of every school, for resolving names typed in or read from other tables.
+    # Each school in the data has to come back to its own row from its primary name, or
+    # typed spellings of it would land on another school.
+    index = NameIndex(load_fact_schools(FACT_SCHOOLS))
+    schools = _load(checksum)[0]['School']
+    primary = index.resolve(schools)
+    wrong = primary.notna().to_numpy() & (index.resolve_within(primary, schools).to_numpy() != schools.to_numpy())
+    if wrong.any():
+        raise ValueError(f"{FACT_SCHOOLS} gives these schools in {PERFORMANCE_DATA} the same primary name as another school: {list(schools[wrong])}")
+    return index
+
+
+@lru_cache(maxsize=2)
+def cost_model(checksum):
+    # Building and per-student cost coefficients for the savings estimate, per data version
+    return fit_cost_model(pd.read_csv(WRS_TABLE), pd.read_csv(SPS_DATA_EXTRACT), school_names(checksum),
+                          _load(checksum)[0]['School'])
+
+
+def sampling_totals(checksum):
+    # Students behind each row of the redistribution matrix, for resampling its weights
+    return _load(checksum)[3]
+
+
+def load_data():
+    # Parsed and cleaned once per process per data version. The same objects are
+    # shared by every session, so callers must copy the frame before changing it.
+    checksum = data_checksum()
+    data, matrix, counts, _ = _load(checksum)
+    return checksum, data, matrix, counts
+
+
+class ResultCache:
+    # Small thread-safe LRU, for results keyed by (data checksum, frozen closure set)
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
+redistribution_cache = ResultCache()
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import cost_model, filter_index, load_data, school_names
+from scenarios import TILE_NAMES, evaluate_scenarios, masks_from_sets
+
+
+def redistribution_columns(data, student_counts, after, rows=None, previous=None):
+    # The columns the app and the tables derive from redistributed counts, as arrays.
+    # Given previous, the columns for earlier counts, only the schools in rows (e.g.
+    # SimulationState.changed) are recomputed.
+    if previous is None or rows is None:
+        rows = slice(None)
+        columns = {'Enrollment from Redistribution': np.zeros(len(data), dtype=int), 'Total Enrollment': np.zeros(len(data), dtype=int),
+                   'Redistribution Capacity': np.zeros(len(data))}
+    else:
+        columns = {name: values.copy() for name, values in previous.items()}
+    added = (np.asarray(after, dtype=float)[rows] - np.asarray(student_counts, dtype=float)[rows]).astype(int)
+    total = (data['Total AAFTE* Enrollment (ENROLLMENT)'].to_numpy()[rows] + added).astype(int)
+    columns['Enrollment from Redistribution'][rows] = added
+    columns['Total Enrollment'][rows] = total
+    columns['Redistribution Capacity'][rows] = total / data['Capacity'].to_numpy(dtype=float)[rows]
+    return columns
+
+
+def apply_redistribution(data, student_counts, after, columns=None):
+    # Copy of data with the redistribution_columns, computed here unless given
+    return data.assign(**(redistribution_columns(data, student_counts, after) if columns is None else columns))
+
+
+class Engine:
+    # The simulation without Streamlit: data, redistribution matrix and filter index
+    # loaded once, closure sets given by school name or row index, or picked with the
+    # same range and category filters as the sidebar.
+
+    def __init__(self):
+        self.checksum, self.data, self.matrix, self.counts = load_data()
+        self.index = filter_index(self.checksum)
+        self.cost_model = cost_model(self.checksum)
+        self.names = school_names(self.checksum)
+        self.schools = self.data['School'].to_numpy(dtype=str)
+        self.capacity = self.data['Capacity'].to_numpy(dtype=float)
+        self.position = {school: row for row, school in enumerate(self.schools)}
+
+    def resolve(self, schools):
+        # Row indexes for a list of school names and/or row indexes. Names can be any
+        # spelling the name index knows ('MLK', 'Northgate').
+        rows = []
+        for school in schools:
+            if isinstance(school, str):
+                if school not in self.position:
+                    resolved = self.names.resolve_within([school], self.schools).iloc[0]
+                    if resolved not in self.position:
+                        raise ValueError(f"unknown school {school!r}")
+                    school = resolved
+                rows.append(self.position[school])
+            elif isinstance(school, (int, np.integer)) and not isinstance(school, bool) and 0 <= school < len(self.schools):
+                rows.append(int(school))
+            else:
+                raise ValueError(f"schools are given by name or by row index below {len(self.schools)}, got {school!r}")
+        return sorted(set(rows))
+
+    def closure_set(self, schools=(), ranges=None, categories=None):
+        # Schools matching every filter, plus the schools listed by name or index, as in
+        # the sidebar. No filters means only the listed schools.
+        #   ranges: {column: (low, high)}, categories: {column: allowed values}
+        rows = set(self.resolve(schools))
+        if ranges or categories:
+            for column in list(ranges or {}) + list(categories or {}):
+                if column not in self.index.bounds and column not in self.index.codes:
+                    raise ValueError(f"can't filter on {column!r}")
+            mask = self.index.mask({column: tuple(bounds) for column, bounds in (ranges or {}).items()}, categories or {})
+            rows.update(np.flatnonzero(mask).tolist())
+        return sorted(rows)
+
+    def evaluate(self, closed_sets, per_school=True):
+        # Post-closure enrollment and capacity of every school, and the district totals
+        # shown in the app's metric tiles and the estimated annual savings, for each
+        # closure set (lists of row indexes). Closed schools have zero enrollment and capacity.
+        results = evaluate_scenarios(self.counts, self.matrix, self.capacity, masks_from_sets(closed_sets, len(self.schools)),
+                                     cost_model=self.cost_model)
+        scenarios = []
+        for row, closed in enumerate(closed_sets):
+            scenario = {'closed': list(closed),
+                        'totals': dict(zip(TILE_NAMES, results['tiles'][row].astype(int).tolist())),
+                        'stranded': float(results['stranded'][row]),
+                        'savings': round(float(results['savings'][row]))}
+            if per_school:
+                scenario['enrollment'] = results['enrollment'][row].astype(int).tolist()
+                scenario['capacity_percent'] = results['redistribution_capacity'][row].round(4).tolist()
+            scenarios.append(scenario)
+        return scenarios
+
+
+if __name__ == '__main__':
+    from presets import PROPOSED_OPTION_A
+
+    engine = Engine()
+    scenario, = engine.evaluate([engine.closure_set(PROPOSED_OPTION_A)], per_school=False)
+    print(scenario['totals'])
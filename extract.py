@@ -0,0 +1,203 @@
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from names import NameIndex, load_fact_schools
+
+
+BUDGET_BOOK = 'data/budget_adopted_2023_2024.pdf'
+CACHE_DIR = 'data/.cache/pages'
+OUTPUT = 'data/sps_data_extract.csv'
+
+# Pages 67-128 are elementary schools, 131-140 K-8 schools and 168 partnership schools
+BUDGET_BOOK_PAGES = list(range(67, 129)) + list(range(131, 141)) + list(range(168, 169))
+
+# Lots of akas for school names in the PDF and website, on top of the ones in fact_schools.csv
+SCHOOL_NAME_FIXES = {
+    'Cascadia Elementrary': 'Cascadia Elementary',
+    'Rising Star Academy': 'Rising Star Elementary',
+    'John Stanford Elementary': 'John Stanford International Elementary',
+    'Northgate Elementary': 'James Baldwin Elementary',
+    'McDonald Intl. Elementary': 'McDonald International Elementary',
+    'Madrona K-5': 'Madrona Elementary',
+    'Martin Luther King Jr. Elementary': 'Martin Luther King, Jr. Elementary',
+    'Genesse Hill Elementary': 'Genesee Hill Elementary',
+    'Dearborn Park Intl. Elementary': 'Dearborn Park International Elementary',
+    'B.F. Day Elementary': 'Benjamin Franklin Day Elementary',
+    'Concord Intl. Elementary': 'Concord International Elementary',
+    'Franz Coe Elementary': 'Coe Elementary',
+    'Beacon Hill Intl. Elementary': 'Beacon Hill International Elementary',
+}
+
+BUDGET_COLUMNS = ['Bilingual Education (BUDGET)','General Education (BUDGET)','Other Grants (BUDGET)','Special Education (BUDGET)',
+                  'State LAP (BUDGET)','Total Budget (BUDGET)','Seattle Ed. Levy (BUDGET)','Federal Title I (BUDGET)']
+DEMOGRAPHICS_COLUMNS = ['Bilingual Education (ENROLLMENT)','Free and Reduced Lunch (ENROLLMENT)','Special Education (ENROLLMENT)',
+                        'Total AAFTE* Enrollment (ENROLLMENT)']
+YEARS = ['2021-22', '2022-23', '2023-24']
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_dataframe_with_column(dfs, column_name):
+    for idx, df in enumerate(dfs):
+        if column_name in df.columns:
+            return idx
+    return -1  # Return -1 if the column name is not found in any DataFrame
+
+
+def school_name(raw_text):
+    # The school name is the text in front of a weird string in the PDF, as printed;
+    # build_extract resolves it to the primary name
+    return raw_text[0:raw_text.find('A.2023-24')]
+
+
+def page_table(dataframes, header, label, suffix):
+    # Find the DataFrame that contains the table, it varies by page because of nuances with PDFPlumber
+    table_index = find_dataframe_with_column(dataframes, header)
+    if table_index < 0:
+        return None
+    table_b = dataframes[table_index][[None]][None].str.split(' ', expand=True)
+    table_a = dataframes[table_index].iloc[:, 0:1]
+
+    # Overwrite the column names with the correct ones, Merge the two DataFrames
+    table_a.columns = [label]
+    table_b.columns = YEARS
+    table = pd.merge(table_a, table_b, left_index=True, right_index=True)
+    table[label] = table[label] + f' ({suffix})'
+    for year in YEARS:
+        table[year] = table[year].str.replace('$', '').str.replace(',', '').astype(float)
+
+    table = table.pivot_table(columns=label, values=YEARS, aggfunc='sum')
+    table.columns.name = 'Index'
+    return table.reset_index().rename(columns={'index': 'Year'})
+
+
+def parse_page(dataframes, raw_text):
+    # Budget and demographics tables of one school's page, each with the school name added
+    name = school_name(raw_text)
+    tables = []
+    for header, label, suffix in (('School Year\nFunding Type 21-22 22-23 23-24', 'Budget', 'BUDGET'),
+                                  ('School Year\n21-22 22-23 23-24', 'Demographic', 'ENROLLMENT')):
+        table = page_table(dataframes, header, label, suffix)
+        if table is not None:
+            table.insert(0, 'School', name)
+        tables.append(table)
+    return tables
+
+
+# Each worker process opens the PDF once and keeps it open for every page it is given
+_pdf = None
+_viewer = None
+
+
+def _open_pdf(path):
+    global _pdf, _viewer
+    import pdfplumber
+    from pdfreader import SimplePDFViewer
+    _pdf = pdfplumber.open(path)
+    _viewer = SimplePDFViewer(open(path, 'rb'))
+
+
+def _extract_page(page_num):
+    dataframes = [pd.DataFrame(table[1:], columns=table[0]) for table in _pdf.pages[page_num].extract_tables()]
+    _viewer.navigate(page_num + 1)
+    _viewer.render()
+    return page_num, parse_page(dataframes, ''.join(_viewer.canvas.strings))
+
+
+def extract_pages(pdf_path, pages, workers=None, cache_dir=CACHE_DIR, use_cache=True):
+    # Parsed (budget, demographics) tables per page. Pages already parsed for this exact
+    # PDF come from the on-disk cache; the rest are fanned out to a process pool.
+    cache = os.path.join(cache_dir, file_hash(pdf_path)[:16])
+    os.makedirs(cache, exist_ok=True)
+    parsed = {}
+    missing = []
+    for page in pages:
+        path = os.path.join(cache, f'{page}.pkl')
+        if use_cache and os.path.exists(path):
+            parsed[page] = pd.read_pickle(path)
+        else:
+            missing.append(page)
+
+    if missing:
+        workers = workers or os.cpu_count()
+        chunksize = max(1, len(missing) // (workers * 4))
+        with ProcessPoolExecutor(workers, initializer=_open_pdf, initargs=(pdf_path,)) as pool:
+            for page, tables in pool.map(_extract_page, missing, chunksize=chunksize):
+                pd.to_pickle(tables, os.path.join(cache, f'{page}.pkl'))
+                parsed[page] = tables
+    return parsed, len(missing)
+
+
+def rename_schools(table, names, columns):
+    # Primary school names from a names.NameIndex; names it can't resolve become NaN
+    return table.assign(School=names.resolve(table['School']))[['School','Year'] + columns]
+
+
+def build_extract(parsed, names, coords):
+    # Concatenate every page once, fix the names and join budget, demographics and coordinates
+    budget = pd.concat([tables[0] for tables in parsed.values() if tables[0] is not None], ignore_index=True)
+    demographics = pd.concat([tables[1] for tables in parsed.values() if tables[1] is not None], ignore_index=True)
+    for column in BUDGET_COLUMNS:
+        if column not in budget.columns:
+            budget[column] = float('nan')
+    x = rename_schools(budget, names, BUDGET_COLUMNS)
+    y = rename_schools(demographics, names, DEMOGRAPHICS_COLUMNS)
+
+    z = pd.merge(x, y, on=['School','Year'])
+    z = pd.merge(z, coords, how='left', on='School')
+
+    # Calculate helpful additional columns from existing data and cast numeric values to floats
+    z['Budget Efficiency'] = z['Total Budget (BUDGET)'].astype(float) / z['Total AAFTE* Enrollment (ENROLLMENT)'].astype(float)
+    z['Total AAFTE* Enrollment (ENROLLMENT)'] = z['Total AAFTE* Enrollment (ENROLLMENT)'].astype(float)
+    return z
+
+
+def parse_pages(text):
+    # '67-128 131-140 168' -> list of page numbers
+    pages = []
+    for part in text:
+        start, _, stop = part.partition('-')
+        pages.extend(range(int(start), int(stop or start) + 1))
+    return pages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract per-school budget and demographics tables from the SPS budget book.')
+    parser.add_argument('--pdf', default=BUDGET_BOOK)
+    parser.add_argument('--pages', nargs='+', help="page ranges such as '67-128 131-140 168' (default: the 2023-24 budget book's school pages)")
+    parser.add_argument('--coords', default=OUTPUT, help='CSV with School, Full Address, Latitude, Longitude, Closest School and Distance to Closest School (miles)')
+    parser.add_argument('--output', default=OUTPUT)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--no-cache', action='store_true', help='re-parse every page even if it is cached')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pages = parse_pages(args.pages) if args.pages else BUDGET_BOOK_PAGES
+    parsed, num_parsed = extract_pages(args.pdf, pages, args.workers, use_cache=not args.no_cache)
+    skipped = [page for page, tables in parsed.items() if tables[0] is None or tables[1] is None]
+
+    coords = pd.read_csv(args.coords)[['School','Full Address','Latitude','Longitude','Closest School','Distance to Closest School (miles)']]\
+        .drop_duplicates('School')
+    names = NameIndex(load_fact_schools(), SCHOOL_NAME_FIXES)
+    extract = build_extract(parsed, names, coords)
+    extract.to_csv(args.output, index=False)
+
+    print(f"{len(pages)} pages ({num_parsed} parsed, {len(pages) - num_parsed} cached) -> {len(extract)} rows in {args.output} "
+          f"in {time.perf_counter() - start:.1f} s")
+    if skipped:
+        print(f"Pages without a budget or demographics table: {skipped}")
+    unmatched = names.unmatched(pd.Series([table['School'].iloc[0] for tables in parsed.values() for table in tables if table is not None],
+                                          name='Budget book'))
+    if len(unmatched):
+        print(f"School names that matched no school, dropped from the extract:\n{unmatched.to_string(index=False)}")
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Numeric columns the sidebar can filter on with a range slider
+RANGE_COLUMNS = ['Total Budget (BUDGET)', 'Excess Budget per Student', 'Budget Efficiency', 'Distance to Closest School (miles)',
+                 'Disadvantage Score', 'Total AAFTE* Enrollment (ENROLLMENT)', 'Capacity Percent', 'Capacity', 'Building Condition Score']
+
+# Columns filtered by membership in a list of values
+CATEGORY_COLUMNS = ['Landmark', 'Use', 'School']
+
+
+class FilterIndex:
+    # Built once per data version. Holds each column's min/max for the slider bounds and
+    # a sorted copy of each numeric column, so a range predicate is two searchsorted
+    # calls instead of two full-column comparisons. Each predicate's mask is cached, so
+    # moving one slider only computes that slider's mask.
+
+    def __init__(self, data, range_columns=RANGE_COLUMNS, category_columns=CATEGORY_COLUMNS, max_masks=512):
+        self.num_rows = len(data)
+        self.bounds = {}
+        self.order = {}
+        self.sorted_values = {}
+        for column in range_columns:
+            values = data[column].to_numpy(dtype=float)
+            order = np.argsort(values, kind='stable')
+            self.order[column] = order
+            self.sorted_values[column] = values[order]
+            self.bounds[column] = (np.nanmin(values), np.nanmax(values))
+
+        self.codes = {}
+        self.unique = {}
+        for column in category_columns:
+            values = data[column].to_numpy()
+            self.unique[column] = list(dict.fromkeys(values))
+            self.codes[column] = values
+
+        self.max_masks = max_masks
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _cached(self, key, compute):
+        with self.lock:
+            if key in self.masks:
+                self.masks.move_to_end(key)
+                return self.masks[key]
+        mask = compute()
+        mask.setflags(write=False)
+        with self.lock:
+            self.masks[key] = mask
+            while len(self.masks) > self.max_masks:
+                self.masks.popitem(last=False)
+        return mask
+
+    def range_mask(self, column, low, high):
+        # Rows with low <= value <= high; missing values never match
+        def compute():
+            values = self.sorted_values[column]
+            start = np.searchsorted(values, low, side='left')
+            stop = np.searchsorted(values, high, side='right')
+            mask = np.zeros(self.num_rows, dtype=bool)
+            mask[self.order[column][start:stop]] = True
+            return mask
+        return self._cached((column, float(low), float(high)), compute)
+
+    def isin_mask(self, column, values):
+        values = frozenset(values)
+        return self._cached((column, values), lambda: np.isin(self.codes[column], list(values)))
+
+    def mask(self, ranges, categories):
+        # And together the cached mask of every predicate.
+        #   ranges: {column: (low, high)}, categories: {column: allowed values}
+        mask = np.ones(self.num_rows, dtype=bool)
+        for column, (low, high) in ranges.items():
+            mask &= self.range_mask(column, low, high)
+        for column, values in categories.items():
+            mask &= self.isin_mask(column, values)
+        return mask
@@ -0,0 +1,86 @@
+import folium
+import numpy as np
+import pandas as pd
+
+
+low_range_color = 'lightblue'
+mid_range_color = 'blue'
+high_range_color = 'darkblue'
+closed_school_color = 'red'
+
+
+def capacity_colors(capacity_percent):
+    # Lighter schools are of less capacity, darker schools have higher capacity
+    capacity_percent = np.asarray(capacity_percent, dtype=float)
+    return np.select([capacity_percent < 0.75, capacity_percent < 0.95],
+                     [low_range_color, mid_range_color], high_range_color)
+
+
+def base_map(data):
+    # Dark base map centered on the schools. Built once per session and reused, so
+    # reruns only swap the school layer passed to st_folium.
+    return folium.Map(location=[data['latitude'].mean(), data['longitude'].mean()], zoom_start=11, tiles='CartoDB dark_matter')
+
+
+def school_features(data, colors, popups, changed=None):
+    # One GeoJSON point feature per school. Schools in 'changed' get a white outline.
+    if changed is None:
+        changed = np.zeros(len(data), dtype=bool)
+    borders = np.where(changed, 'white', colors)
+    return [
+        {'type': 'Feature',
+         'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+         'properties': {'popup': popup, 'color': color, 'border': border}}
+        for lat, lon, popup, color, border in zip(data['latitude'].to_numpy(), data['longitude'].to_numpy(),
+                                                  popups, colors, borders)
+    ]
+
+
+def feature_layer(features, name='Schools'):
+    # All schools as one GeoJSON layer of circle markers, instead of a Marker and
+    # Icon per school
+    layer = folium.FeatureGroup(name=name)
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        marker=folium.CircleMarker(radius=8, fill=True, fill_opacity=0.9, weight=3),
+        style_function=lambda feature: {'fillColor': feature['properties']['color'], 'color': feature['properties']['border']},
+        popup=folium.GeoJsonPopup(fields=['popup'], labels=False),
+    ).add_to(layer)
+    return layer
+
+
+def school_layer(data, colors, popups, changed=None, name='Schools'):
+    return feature_layer(school_features(data, colors, popups, changed), name)
+
+
+def before_layer(data):
+    popups = data['School'] + ' (' + (data['Capacity Percent'] * 100).round().astype(int).astype(str) + '%)'
+    return school_layer(data, capacity_colors(data['Capacity Percent']), popups.to_numpy(), name='Before')
+
+
+def after_features(data, closed, bands=None, rows=None, previous=None):
+    # Features of the 'after' layer. Given previous, the features for earlier counts,
+    # only the schools in rows (e.g. SimulationState.changed) are rebuilt.
+    # bands: optional uncertainty.UncertaintyBands, adding each school's capacity range
+    # and chance of ending over 100% to its popup
+    closed = np.asarray(closed, dtype=bool)
+    if previous is None or rows is None:
+        rows, features = np.arange(len(data)), [None] * len(data)
+    else:
+        features = list(previous)
+    data, closed = data.iloc[rows], closed[rows]
+    colors = np.where(closed, closed_school_color, capacity_colors(data['Redistribution Capacity']))
+    popups = (data['School'] + ' (' + (data['Capacity Percent'] * 100).round().astype(int).astype(str) + '% -> '
+              + (data['Redistribution Capacity'] * 100).round().astype(int).astype(str) + '%)')
+    if bands is not None:
+        ranges = pd.Series([f", likely {low:.0f}-{high:.0f}%, {over:.0%} chance over 100%" for low, high, over
+                            in zip(bands.capacity[0][rows] * 100, bands.capacity[-1][rows] * 100, bands.p_over[rows])], index=data.index)
+        popups = popups + ranges.where(~closed, '')
+    changed = (data['Enrollment from Redistribution'] != 0).to_numpy() & ~closed
+    for row, feature in zip(rows, school_features(data, colors, popups.to_numpy(), changed)):
+        features[row] = feature
+    return features
+
+
+def after_layer(data, closed, bands=None, features=None):
+    return feature_layer(after_features(data, closed, bands) if features is None else features, name='After')
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from capacity_buckets import OVER, classify
+from scenarios import evaluate_scenarios
+
+
+def marginal_impact(student_counts, redistribution_matrix, capacity, base_mask, names, cost_model=None, thresholds=(0.75, 1.0)):
+    # What closing each school still open would add to the closure set in base_mask,
+    # one row per open school. The base set and every one-more-closure set go through
+    # evaluate_scenarios together, so the n extra scenarios are a few batched matrix
+    # products rather than n solves.
+    #   Students Displaced: the school's own enrollment, which has to move
+    #   Worst Receiving Capacity %: the fullest school taking in any of those students
+    #   Schools Newly Over 100%: open schools pushed over the high threshold
+    #   Budget Freed: change in estimated annual savings, with a savings.CostModel
+    student_counts = np.asarray(student_counts, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    base_mask = np.asarray(base_mask, dtype=bool)
+    candidates = np.flatnonzero(~base_mask)
+
+    masks = np.repeat(base_mask[None, :], len(candidates) + 1, axis=0)
+    masks[np.arange(1, len(candidates) + 1), candidates] = True
+    results = evaluate_scenarios(student_counts, redistribution_matrix, capacity, masks, thresholds=thresholds, cost_model=cost_model)
+
+    enrollment = results['enrollment']
+    receiving = enrollment[1:] > enrollment[0]
+    worst = np.where(receiving, results['redistribution_capacity'][1:], -np.inf).max(axis=1, initial=-np.inf)
+    over = classify(results['redistribution_capacity'], masks, thresholds) == OVER
+    table = pd.DataFrame({
+        'School': np.asarray(names)[candidates],
+        'Students Displaced': student_counts[candidates].astype(int),
+        'Worst Receiving Capacity %': np.where(np.isfinite(worst), worst * 100, np.nan).round(1),
+        f'Schools Newly Over {thresholds[1]*100:.0f}%': (over[1:] & ~over[0]).sum(axis=1),
+    }, index=candidates)
+    if cost_model is not None:
+        table['Budget Freed'] = (results['savings'][1:] - results['savings'][0]).round()
+    return table
+
+
+if __name__ == '__main__':
+    import time
+    from data_loader import cost_model, load_data
+    from presets import PROPOSED_OPTION_A
+
+    checksum, data, matrix, counts = load_data()
+    mask = data['School'].isin(PROPOSED_OPTION_A).to_numpy()
+    start = time.perf_counter()
+    table = marginal_impact(counts, matrix, data['Capacity'], mask, data['School'], cost_model(checksum))
+    print(f"{len(table)} schools in {(time.perf_counter() - start)*1000:.1f} ms")
+    print(table.sort_values('Budget Freed', ascending=False).head(10).to_string())
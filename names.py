@@ -0,0 +1,187 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+FACT_SCHOOLS = 'data/fact_schools.csv'
+
+# Spelled-out forms of abbreviations the source documents use
+ABBREVIATIONS = {'intl': 'international', 'bf': 'benjamin franklin', 'mlk': 'martin luther king', 'jr': ''}
+# Words that say what kind of school it is rather than which school, dropped before comparing
+GENERIC_WORDS = ['elementary', 'elementrary', 'school', 'academy', 'k 5', 'k 8', 'pk 8', 'k 12']
+# Fuzzy matches need this much trigram overlap (Dice coefficient), and must beat the best
+# candidate for a different school by MIN_MARGIN, so 'Olympic Hills Olympic View' stays unmatched
+MIN_SCORE = 0.6
+MIN_MARGIN = 0.1
+
+
+def load_fact_schools(path=FACT_SCHOOLS):
+    # Fact Schools - due to misspelled school names in the PDFs
+    load_fact_schools = pd.read_csv(path)
+    return pd.merge(load_fact_schools, load_fact_schools, how='left', left_on='Primary Index', right_on='Index')[['School_x','Index_x','School_y','Index_y', 'School Type_y']]\
+        .rename(columns={'School_x':'Text','School_y':'School', 'Index_y':'Key', 'Index_x':'Index', 'School Type_y':'Type'})[['Key','Text','School','Index','Type']]
+
+
+def normalize(names):
+    # Comparable form of school names, for a whole column at once:
+    # 'Martin Luther King Jr. Elementary' -> 'martin luther king', 'McDonald Intl.' -> 'mcdonald international'
+    names = pd.Series(names, dtype='string').str.lower()
+    names = names.str.replace('&', ' and ', regex=False).str.replace(r"[.,'’()/-]", ' ', regex=True)
+    for short, full in ABBREVIATIONS.items():
+        names = names.str.replace(rf'\b{short}\b', full, regex=True)
+    names = names.str.replace(r'\b(?:' + '|'.join(GENERIC_WORDS) + r')\b', ' ', regex=True)
+    return names.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    # Every known spelling of every school, mapped to its primary name. Names are matched
+    # exactly, then in normalized form, then by trigram overlap against the normalized
+    # aliases. The fuzzy step is a sparse product over the trigrams a name shares with
+    # the aliases, so it never compares against every alias one at a time.
+    #   fact_schools: load_fact_schools(), Text -> School
+    #   aliases: extra {spelling: any known spelling}, e.g. extract.SCHOOL_NAME_FIXES
+
+    def __init__(self, fact_schools, aliases=None):
+        exact = fact_schools.drop_duplicates('Text').set_index('Text')['School']
+        # Primary names are spellings of themselves too
+        exact = pd.concat([exact, exact.drop_duplicates().set_axis(exact.drop_duplicates())])
+        exact = exact[~exact.index.duplicated()]
+        if aliases:
+            extra = pd.Series(aliases).map(exact).dropna()
+            exact = pd.concat([exact, extra])
+        self.exact = exact[~exact.index.duplicated()]
+        self.schools = pd.Index(self.exact.unique())
+
+        # Normalized spellings that point at exactly one school
+        normalized = pd.DataFrame({'name': normalize(self.exact.index).to_numpy(), 'school': self.exact.to_numpy()})
+        normalized = normalized[normalized['name'] != ''].drop_duplicates()
+        unique = normalized.groupby('name')['school'].transform('nunique') == 1
+        self.normalized = normalized[unique].drop_duplicates('name').set_index('name')['school']
+
+        # Binary (alias x trigram) matrix over the unambiguous normalized aliases
+        self.aliases = self.normalized.index.to_numpy()
+        self.alias_schools = self.normalized.to_numpy()
+        self.vocabulary = {}
+        self.alias_trigrams = self._trigram_matrix(self.aliases, grow=True)
+        self.alias_sizes = np.asarray(self.alias_trigrams.sum(axis=1)).ravel()
+
+    def _trigram_matrix(self, names, grow=False):
+        rows, columns = [], []
+        for row, name in enumerate(names):
+            for gram in trigrams(name):
+                if grow:
+                    self.vocabulary.setdefault(gram, len(self.vocabulary))
+                column = self.vocabulary.get(gram)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(names), len(self.vocabulary)))
+
+    def fuzzy(self, names):
+        # Best alias for each name by trigram Dice coefficient: (school, alias, score),
+        # with school None when it's below MIN_SCORE or too close to another school.
+        # Only the (name, alias) pairs sharing a trigram are scored, as the nonzeros of a
+        # sparse product, and each name's best and best other-school scores come from its
+        # row of those.
+        names = normalize(names).fillna('').to_numpy()
+        sizes = np.array([len(trigrams(name)) for name in names], dtype=float)
+        shared = (self._trigram_matrix(names) @ self.alias_trigrams.T).tocsr()
+        rows = np.repeat(np.arange(len(names)), np.diff(shared.indptr))
+        scores = 2 * shared.data / (sizes[rows] + self.alias_sizes[shared.indices])
+
+        # Names sharing no trigram keep alias 0 with a score of 0
+        best = np.zeros(len(names), dtype=int)
+        best_score = np.zeros(len(names))
+        rival = np.zeros(len(names))
+        found = np.diff(shared.indptr) > 0
+        if found.any():
+            starts = shared.indptr[:-1][found]
+            # Each row's entries by descending score, the lowest alias first on ties
+            first = np.lexsort((shared.indices, -scores, rows))[starts]
+            best[found] = shared.indices[first]
+            best_score[found] = scores[first]
+            other = np.where(self.alias_schools[shared.indices] != self.alias_schools[best][rows], scores, 0.0)
+            rival[found] = np.maximum.reduceat(other, starts)
+        accepted = (best_score >= MIN_SCORE) & (best_score - rival >= MIN_MARGIN)
+        return pd.DataFrame({'school': np.where(accepted, self.alias_schools[best], None),
+                             'alias': self.aliases[best], 'score': best_score.round(3)})
+
+    def match(self, names, fuzzy=True):
+        # Primary name and how it was found ('exact', 'normalized', 'fuzzy' or None) for
+        # every name in the column. Each distinct unmatched name is looked up once.
+        names = pd.Series(names)
+        school = names.map(self.exact)
+        method = pd.Series(np.where(school.notna(), 'exact', None), index=names.index, dtype=object)
+
+        missing = school.isna() & names.notna()
+        school[missing] = normalize(names[missing]).map(self.normalized).to_numpy()
+        method[missing & school.notna()] = 'normalized'
+
+        missing = school.isna() & names.notna()
+        if fuzzy and missing.any() and len(self.aliases):
+            distinct = pd.unique(names[missing])
+            found = pd.Series(self.fuzzy(distinct)['school'].to_numpy(), index=distinct)
+            school[missing] = names[missing].map(found).to_numpy()
+            method[missing & school.notna()] = 'fuzzy'
+        return pd.DataFrame({'school': school, 'method': method})
+
+    def resolve(self, names, fuzzy=True):
+        # Primary school name for every name in the column, NaN where nothing matches
+        return self.match(names, fuzzy)['school'].rename(getattr(names, 'name', None))
+
+    def resolve_within(self, names, schools):
+        # Each name as one of 'schools', e.g. the data's School column, which doesn't
+        # always use the primary name ('Cascade Parent Partnership' for 'CPPP/North Queen
+        # Anne'). Names already in schools are kept as they are; others are resolved and
+        # mapped to the school with the same primary name. NaN where there's none.
+        names = pd.Series(names, dtype=object)
+        schools = pd.Series(schools, dtype=object).drop_duplicates()
+        by_primary = pd.Series(schools.to_numpy(), index=self.resolve(schools).to_numpy())
+        by_primary = by_primary[by_primary.index.notna() & ~by_primary.index.duplicated(keep=False)]
+        return names.where(names.isin(set(schools)), self.resolve(names).map(by_primary))
+
+    def unmatched(self, columns, resolve=None):
+        # Report of names that resolve to no school, with how many rows use them and the
+        # closest alias with its score. 'columns' is one column or {source: column};
+        # resolve maps a column to primary names, self.resolve unless another matcher
+        # (e.g. an exact join) decides which names are kept.
+        if not isinstance(columns, dict):
+            columns = {getattr(columns, 'name', None): columns}
+        resolve = resolve or self.resolve
+        reports = []
+        for source, values in columns.items():
+            values = pd.Series(values).dropna()
+            counts = values[resolve(values).isna().to_numpy()].value_counts()
+            closest = self.fuzzy(counts.index)
+            reports.append(pd.DataFrame({'Source': source, 'Name': counts.index, 'Rows': counts.to_numpy(),
+                                         'Closest': closest['alias'].to_numpy(), 'Score': closest['score'].to_numpy()}))
+        return pd.concat(reports, ignore_index=True)
+
+
+@lru_cache(maxsize=2)
+def name_index(path=FACT_SCHOOLS):
+    # Name index over fact_schools.csv, built once per process
+    return NameIndex(load_fact_schools(path))
+
+
+if __name__ == '__main__':
+    import time
+
+    start = time.perf_counter()
+    index = name_index()
+    print(f"{len(index.exact)} spellings of {len(index.schools)} schools, {len(index.aliases)} normalized, "
+          f"{len(index.vocabulary)} trigrams in {(time.perf_counter() - start)*1000:.1f} ms")
+
+    attending_live = pd.read_csv('data/fact_student_attending_live.csv')
+    live_attending = pd.read_csv('data/fact_student_live_attending.csv')
+    wrs_table = pd.read_csv('data/wrs_table.csv')
+    print(index.unmatched({'Attending School': attending_live['Attending School'], 'Live Location': attending_live['Live Location'],
+                           'Attendance Area': live_attending['Attendance Area'], 'School': live_attending['School'],
+                           'WRS': wrs_table['Schools'].str.strip()}).to_string(index=False))
@@ -0,0 +1,217 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from redistribution import as_weights
+from scenarios import evaluate_scenarios, masks_from_sets
+
+
+def _evaluate_chunk(args):
+    # Counts before the whole-student truncation, so fractional inflow still counts
+    # against max_capacity
+    student_counts, redistribution_matrix, capacity, masks = args
+    results = evaluate_scenarios(student_counts, redistribution_matrix, capacity, masks)
+    return results['counts'], results['stranded']
+
+
+class ClosureOptimizer:
+    # Searches for the set of K schools to close that maximizes an additive objective
+    # (e.g. the budget freed by closing them) subject to:
+    #   max_capacity:  no school receiving students ends above this Redistribution Capacity
+    #   max_displaced: cap on the students enrolled at the closed schools
+    #   exclude_landmarks: never close a school with Landmark == 'Y'
+    #   max_distance:  only close schools within this many miles of another school
+    # Feasibility is checked with the batch engine, a whole neighbourhood at a time, in a
+    # process pool kept for the whole run when processes is set.
+
+    def __init__(self, data, redistribution_matrix, objective='Total Budget (BUDGET)', max_capacity=1.0,
+                 max_displaced=None, exclude_landmarks=True, max_distance=None, processes=None):
+        self.student_counts = data['Total AAFTE* Enrollment (ENROLLMENT)'].to_numpy(dtype=float)
+        self.capacity = data['Capacity'].to_numpy(dtype=float)
+        self.score = data[objective].to_numpy(dtype=float)
+        self.schools = data['School'].to_numpy()
+        self.matrix = as_weights(redistribution_matrix)
+        self.max_capacity = max_capacity
+        self.max_displaced = max_displaced
+        self.processes = processes
+        self.pool = None
+        self.evaluations = 0
+
+        candidates = np.ones(len(self.schools), dtype=bool)
+        if exclude_landmarks:
+            candidates &= (data['Landmark'] != 'Y').to_numpy()
+        if max_distance is not None:
+            candidates &= (data['Distance to Closest School (miles)'] <= max_distance).to_numpy()
+        self.candidates = candidates
+
+    def evaluate(self, masks):
+        self.evaluations += len(masks)
+        if self.pool is None or len(masks) < 2000:
+            return _evaluate_chunk((self.student_counts, self.matrix, self.capacity, masks))
+        chunks = np.array_split(masks, self.processes)
+        parts = list(self.pool.map(_evaluate_chunk, [(self.student_counts, self.matrix, self.capacity, c) for c in chunks]))
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def violations(self, masks):
+        # Which constraint each closure set breaks, one boolean array per constraint
+        counts, stranded = self.evaluate(masks)
+        received = counts > self.student_counts + 1e-9
+        violated = {'max_capacity': (received & (counts / self.capacity > self.max_capacity)).any(axis=1),
+                    # Every displaced student has to land at an open school
+                    'stranded': stranded > 0}
+        if self.max_displaced is not None:
+            violated['max_displaced'] = masks @ self.student_counts > self.max_displaced
+        return violated
+
+    def feasible(self, masks):
+        return ~np.logical_or.reduce(list(self.violations(masks).values()))
+
+    def binding(self, closed):
+        # Why no other school can be added to 'closed': how many of the remaining
+        # candidates each constraint rules out (a school can break several), and how many
+        # schools the landmark and distance filters leave out of the search entirely
+        options = np.flatnonzero(self.candidates & ~closed)
+        masks = np.repeat(closed[None, :], len(options), axis=0)
+        masks[np.arange(len(options)), options] = True
+        counts = {name: int(violated.sum()) for name, violated in self.violations(masks).items()}
+        counts['not_candidates'] = int((~self.candidates).sum())
+        return counts
+
+    def greedy(self, k, per_student=False):
+        # Add the best feasible school one at a time. Ranking by objective per displaced
+        # student leaves more receiving capacity for later picks than ranking by the
+        # objective alone, so both are tried as starting points.
+        rank = self.score / np.maximum(self.student_counts, 1) if per_student else self.score
+        closed = np.zeros(len(self.schools), dtype=bool)
+        for _ in range(k):
+            options = np.flatnonzero(self.candidates & ~closed)
+            masks = np.repeat(closed[None, :], len(options), axis=0)
+            masks[np.arange(len(options)), options] = True
+            ok = self.feasible(masks)
+            if not ok.any():
+                break
+            closed[options[np.argmax(np.where(ok, rank[options], -np.inf))]] = True
+        return closed
+
+    def local_search(self, closed, k, max_rounds=100, keep=10):
+        # Swap one closed school for one open candidate while that improves the
+        # objective, closing one more school instead while fewer than k are closed.
+        # The objective is additive, so each move is scored as
+        # current + score[in] - score[out] and only the redistribution is evaluated.
+        seen = {}
+        current = self.score[closed].sum()
+        for _ in range(max_rounds):
+            options = np.flatnonzero(self.candidates & ~closed)
+            if closed.sum() < k:
+                # -1 marks an add move with nothing reopened
+                out_idx, in_idx = np.full(len(options), -1), options
+            else:
+                out_idx, in_idx = np.meshgrid(np.flatnonzero(closed), options, indexing='ij')
+                out_idx, in_idx = out_idx.ravel(), in_idx.ravel()
+            gains = self.score[in_idx] - np.where(out_idx >= 0, self.score[out_idx], 0.0)
+            # Once enough sets are ranked, only swaps that could beat the worst of them are evaluated
+            if len(seen) >= keep:
+                promising = current + gains > sorted(seen.values())[-keep]
+                out_idx, in_idx, gains = out_idx[promising], in_idx[promising], gains[promising]
+            if not len(gains):
+                break
+
+            masks = np.repeat(closed[None, :], len(gains), axis=0)
+            rows = np.arange(len(gains))
+            masks[rows[out_idx >= 0], out_idx[out_idx >= 0]] = False
+            masks[rows, in_idx] = True
+            ok = self.feasible(masks)
+            for row in np.flatnonzero(ok):
+                seen[frozenset(np.flatnonzero(masks[row]))] = current + gains[row]
+
+            best = np.argmax(np.where(ok, gains, -np.inf))
+            if not ok[best] or (gains[best] <= 0 and out_idx[best] >= 0):
+                break
+            closed = masks[best]
+            current += gains[best]
+        seen[frozenset(np.flatnonzero(closed))] = current
+        return seen
+
+    def run(self, k, n_results=5):
+        start = time.perf_counter()
+        self.evaluations = 0
+        found = {}
+        if self.processes:
+            self.pool = ProcessPoolExecutor(self.processes)
+        try:
+            for per_student in (False, True):
+                found.update(self.local_search(self.greedy(k, per_student), k, keep=n_results))
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+        # Rank the largest closure sets reached, which is k unless the constraints rule that out
+        size = max(len(schools) for schools in found)
+        found = {schools: score for schools, score in found.items() if len(schools) == size}
+        ranked = sorted(found.items(), key=lambda item: -item[1])[:n_results]
+
+        masks = masks_from_sets([schools for schools, _ in ranked], len(self.schools))
+        counts = evaluate_scenarios(self.student_counts, self.matrix, self.capacity, masks)['counts']
+        results = []
+        for (schools, score), mask, row in zip(ranked, masks, counts):
+            # Only schools taking students in are held to max_capacity; schools already
+            # over it that receive nobody don't count
+            received = ~mask & (row > self.student_counts + 1e-9)
+            results.append({
+                'Schools': sorted(self.schools[list(schools)]),
+                'Objective': score,
+                'Students Displaced': self.student_counts[mask].sum(),
+                'Highest Redistribution Capacity': np.max(row / self.capacity, where=received, initial=0.0),
+            })
+        elapsed = time.perf_counter() - start
+        stats = {'evaluations': self.evaluations, 'seconds': elapsed, 'evaluations_per_second': self.evaluations / elapsed}
+        if size < k:
+            # binding: see ClosureOptimizer.binding, for the best set found
+            stats['binding'] = self.binding(masks[0])
+        return results, stats
+
+
+def optimize_closures(data, redistribution_matrix, k, objective='Total Budget (BUDGET)', n_results=5, **constraints):
+    return ClosureOptimizer(data, redistribution_matrix, objective, **constraints).run(k, n_results)
+
+
+if __name__ == '__main__':
+    import argparse
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Search for closure sets that free the most budget.')
+    parser.add_argument('-k', type=int, default=20, help='number of schools to close')
+    parser.add_argument('--objective', default='Total Budget (BUDGET)')
+    parser.add_argument('--max-capacity', type=float, default=1.0)
+    parser.add_argument('--max-displaced', type=float)
+    parser.add_argument('--max-distance', type=float)
+    parser.add_argument('--allow-landmarks', action='store_true')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--results', type=int, default=5)
+    args = parser.parse_args()
+
+    data = pd.read_csv('data/performance_data_2023.csv')
+    data['Landmark'] = data['Landmark'].fillna('N')
+    data['Necessary Budget'] = 500000 + data['Total Budget (BUDGET)']
+    matrix = pd.read_csv('data/redistribution_matrix.csv', index_col=0).values
+
+    results, stats = optimize_closures(data, matrix, args.k, args.objective, args.results,
+                                       max_capacity=args.max_capacity, max_displaced=args.max_displaced,
+                                       exclude_landmarks=not args.allow_landmarks, max_distance=args.max_distance,
+                                       processes=args.processes)
+    if 'binding' in stats:
+        binding = stats['binding']
+        reasons = {'max_capacity': f"push a receiving school over {args.max_capacity:.0%} capacity (--max-capacity)",
+                   'stranded': 'leave students with no open school to go to',
+                   'max_displaced': f"displace more than {args.max_displaced or 0:,.0f} students (--max-displaced)"}
+        remaining = len(data) - binding.pop('not_candidates') - len(results[0]['Schools'])
+        print(f"Only {len(results[0]['Schools'])} of {args.k} schools can be closed within these constraints. "
+              f"Of the {remaining} other schools that may be closed, closing one more would:")
+        for name, count in binding.items():
+            print(f"   {reasons[name]}: {count}")
+    for rank, result in enumerate(results, 1):
+        print(f"{rank}. {args.objective}: ${result['Objective']:,.0f}, {result['Students Displaced']:,.0f} students displaced, "
+              f"highest receiving school capacity {result['Highest Redistribution Capacity']:.0%}")
+        print('   ' + ', '.join(result['Schools']))
+    print(f"{stats['evaluations']:,} evaluations in {stats['seconds']:.2f} s ({stats['evaluations_per_second']:,.0f}/s)")
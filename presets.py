@@ -0,0 +1,19 @@
+# Closure lists for the proposals published by SPS, shared by the app and the offline tools
+
+PROPOSED_OPTION_A = ['Licton Springs/Webster', 'Monroe/Salmon Bay','North Beach Elementary', 'Broadview-Thomson','Green Lake Elementary','Decatur Elementary','Sacajawea Elementary','Cedar Park Elementary','Laurelhurst Elementary','Catharine Blaine K-8','John Hay Elementary',
+                     'McGilvra Elementary', 'Stevens Elementary', 'TOPS/Seward', 'Orca/Whitworth', 'Graham Hill Elementary', 'Dunlap Elementary', 'Rainier View Elementary', 'Lafayette Elementary', 'Louisa Boren (STEM)', 'Sanislo Elementary']
+
+PROPOSED_OPTION_B = ['Licton Springs/Webster','North Beach Elementary','Broadview-Thomson', 'Green Lake Elementary','Decatur Elementary','Cedar Park Elementary','Laurelhurst Elementary', 'Catharine Blaine K-8','John Hay Elementary', 'McGilvra Elementary','Stevens Elementary',
+                     'Thurgood Marshall Elementary', 'Orca/Whitworth', 'Graham Hill Elementary', 'Rainier View Elementary', 'Louisa Boren (STEM)', 'Sanislo Elementary']
+
+# Closure set behind each preset button, in the form Engine.closure_set and the service
+# take: schools by name, and/or the sidebar filters the example narrows. Filters left at
+# the sidebar's defaults match every school, so they're left out.
+PRESETS = {
+    'example_a': {'schools': PROPOSED_OPTION_A},
+    'example_b': {'schools': PROPOSED_OPTION_B},
+    'example_1': {'ranges': {'Total AAFTE* Enrollment (ENROLLMENT)': (0, 300), 'Capacity Percent': (0, 0.75)}},
+    'example_2': {'ranges': {'Capacity Percent': (0, 0.65), 'Building Condition Score': (3, 5)}},
+    'example_3': {'ranges': {'Distance to Closest School (miles)': (0.0, 0.5)}, 'categories': {'Use': ['K-8']}},
+    'example_4': {'ranges': {'Total AAFTE* Enrollment (ENROLLMENT)': (0, 300), 'Capacity': (0, 300)}, 'categories': {'Use': ['K-8', 'E']}},
+}
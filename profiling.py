@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+# One JSON line per rerun on stderr, e.g. for aggregating across sessions:
+#   {"event": "rerun", "session": ..., "total_ms": ..., "stages": {"redistribution": {"ms": ..., "rss_mb": ...}}, ...}
+# Set SPS_PERF_LOG=WARNING to silence them.
+logger = logging.getLogger('sps.perf')
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(os.environ.get('SPS_PERF_LOG', 'INFO'))
+    logger.propagate = False
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    # Resident memory of this process, or None where /proc isn't available. Cheap
+    # enough to read around every stage, unlike tracemalloc.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RunProfile:
+    # Wall time and resident memory of each stage of one script run, plus counters
+    # such as the solver's iteration count. Stages are recorded in the order they
+    # finish; a stage entered twice accumulates its time.
+
+    def __init__(self, session=None, **context):
+        self.session = session
+        self.context = context
+        self.stages = {}
+        self.counters = {}
+        self.errors = []
+        self.start = time.perf_counter()
+        self.logged = False
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            rss_after = rss_bytes()
+            entry = self.stages.setdefault(name, {'ms': 0.0, 'rss_mb': None, 'rss_delta_mb': 0.0})
+            entry['ms'] += (time.perf_counter() - start) * 1000
+            if rss_after is not None:
+                entry['rss_mb'] = rss_after / 2**20
+                entry['rss_delta_mb'] += (rss_after - rss_before) / 2**20
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def error(self, stage, error):
+        # Record and log a failure that the app recovers from, with its traceback
+        self.errors.append({'stage': stage, 'error': f'{type(error).__name__}: {error}'})
+        logger.error('%s failed', stage, exc_info=error)
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def table(self):
+        # Rows for the debug panel: stage, milliseconds, RSS after, RSS change
+        return [{'Stage': name, 'ms': round(entry['ms'], 2),
+                 'RSS (MB)': None if entry['rss_mb'] is None else round(entry['rss_mb'], 1),
+                 'RSS change (MB)': round(entry['rss_delta_mb'], 2)}
+                for name, entry in self.stages.items()]
+
+    def record(self):
+        return {'event': 'rerun', 'session': self.session, **self.context, 'total_ms': round(self.total_ms(), 2),
+                'stages': {name: {key: None if value is None else round(value, 3) for key, value in entry.items()}
+                           for name, entry in self.stages.items()},
+                'counters': self.counters, 'errors': self.errors}
+
+    def log(self):
+        logger.info(json.dumps(self.record(), default=str))
+        self.logged = True
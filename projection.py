@@ -0,0 +1,88 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from redistribution import solve_redistribution
+
+
+SPS_DATA_EXTRACT = 'data/sps_data_extract.csv'
+# performance_data_2023.csv is the 2023-24 school year
+BASE_YEAR = 2023
+PROJECTION_YEARS = tuple(range(2025, 2031))
+# Three years of history can't support steep trends for long, so each school's annual
+# change is held to +/- 10%
+MAX_ANNUAL_CHANGE = 0.10
+
+# enrollment, capacity_percent, stranded: (years x schools), after the closures
+# projected: (years x schools) enrollment with no closures
+Projection = namedtuple('Projection', ['years', 'projected', 'enrollment', 'capacity_percent', 'stranded'])
+
+
+def school_year(label):
+    # '2021-22' -> 2021
+    return int(str(label)[:4])
+
+
+def fit_trends(extract, schools):
+    # Annual log growth of each school's enrollment, in the order of 'schools', from a
+    # least-squares line through log enrollment for every school in one polyfit call.
+    # Schools missing from the extract, or with gaps, don't change.
+    enrollment = extract.pivot_table(index='Year', columns='School', values='Total AAFTE* Enrollment (ENROLLMENT)')
+    enrollment = enrollment.reindex(columns=schools)
+    years = np.array([school_year(label) for label in enrollment.index], dtype=float)
+    values = enrollment.to_numpy(dtype=float)
+    complete = np.isfinite(values).all(axis=0) & (values > 0).all(axis=0)
+
+    growth = np.zeros(len(schools))
+    if len(years) > 1 and complete.any():
+        slope, _ = np.polyfit(years - years.mean(), np.log(values[:, complete]), 1)
+        growth[complete] = slope
+    return np.clip(growth, np.log1p(-MAX_ANNUAL_CHANGE), np.log1p(MAX_ANNUAL_CHANGE))
+
+
+def project_counts(student_counts, growth, years=PROJECTION_YEARS, base_year=BASE_YEAR):
+    # (years x schools) whole-student enrollment, growing each school's base count at
+    # its fitted rate
+    elapsed = np.asarray(years, dtype=float)[:, None] - base_year
+    return np.round(np.asarray(student_counts, dtype=float) * np.exp(growth * elapsed))
+
+
+def project_closures(student_counts, redistribution_matrix, capacity, growth, closed_schools, years=PROJECTION_YEARS):
+    # Redistribution of every projected year's enrollment for one closure set, solved
+    # for all years at once since the closure set, and so the transition blocks, are
+    # shared. Same whole-student truncation as the app's single-year columns.
+    projected = project_counts(student_counts, growth, years)
+    result = solve_redistribution(projected, redistribution_matrix, closed_schools)
+    enrollment = projected + np.trunc(result.counts - projected)
+    return Projection(tuple(years), projected, enrollment, enrollment / np.asarray(capacity, dtype=float), result.stranded)
+
+
+def projection_summary(projection, closed_mask, thresholds=(0.75, 1.0)):
+    # District totals per year for the app: projected enrollment, students stranded by the
+    # closures, and the number of open schools under, between and over the thresholds
+    low, high = thresholds
+    capacity = projection.capacity_percent[:, ~closed_mask]
+    return pd.DataFrame({
+        'District Enrollment': projection.projected.sum(axis=1).astype(int),
+        'Stranded Students': projection.stranded.sum(axis=1).round().astype(int),
+        f'Schools Under {low*100:.0f}%': (capacity < low).sum(axis=1),
+        f'Schools {low*100:.0f}-{high*100:.0f}%': ((capacity >= low) & (capacity <= high)).sum(axis=1),
+        f'Schools Over {high*100:.0f}%': (capacity > high).sum(axis=1),
+    }, index=pd.Index(projection.years, name='Year'))
+
+
+if __name__ == '__main__':
+    import time
+    from data_loader import enrollment_trends, load_data
+    from presets import PROPOSED_OPTION_A
+
+    checksum, data, matrix, counts = load_data()
+    growth = enrollment_trends(checksum)
+    closed = np.flatnonzero(data['School'].isin(PROPOSED_OPTION_A))
+    start = time.perf_counter()
+    projection = project_closures(counts, matrix, data['Capacity'], growth, closed)
+    print(f"{len(projection.years)} years in {(time.perf_counter() - start)*1000:.2f} ms")
+    mask = np.zeros(len(counts), dtype=bool)
+    mask[closed] = True
+    print(projection_summary(projection, mask))
@@ -0,0 +1,154 @@
+import numpy as np
+from collections import namedtuple
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+
+# counts: final student counts per school (closed schools end at 0)
+# stranded: students per closed school of origin with no path to any open school
+# iterations: number of passes needed to resolve chains of closed schools
+RedistributionResult = namedtuple('RedistributionResult', ['counts', 'stranded', 'iterations'])
+
+
+def as_weights(redistribution_matrix):
+    # Float copy of the matrix with the diagonal zeroed. A scipy.sparse matrix stays
+    # sparse (as CSR) so nothing downstream ever builds an n x n dense array.
+    if sparse.issparse(redistribution_matrix):
+        weights = sparse.csr_matrix(redistribution_matrix, dtype=float)
+        weights = (weights - sparse.diags(weights.diagonal())).tocsr()
+        weights.eliminate_zeros()
+        return weights
+    weights = np.array(redistribution_matrix, dtype=float)
+    np.fill_diagonal(weights, 0.0)
+    return weights
+
+
+def row_sums(matrix):
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+
+def scale_rows(matrix, scale):
+    if sparse.issparse(matrix):
+        return (sparse.diags(scale) @ matrix).tocsr()
+    return matrix * scale[:, None]
+
+
+def transition_blocks(redistribution_matrix, closed):
+    # Split the redistribution matrix into the absorbing-chain blocks for a closure set.
+    #   R: closed -> open, each closed row renormalized over the open schools only
+    #   Q: closed -> closed, used only for rows with no weight to any open school,
+    #      so those students follow their closed school's own redistribution instead
+    #      of being dropped.
+    # closed is a boolean mask over schools. Dense input gives dense blocks, sparse
+    # input gives CSR blocks.
+    weights = as_weights(redistribution_matrix)
+    rows = weights[np.flatnonzero(closed)]
+
+    to_open = rows[:, np.flatnonzero(~closed)]
+    to_closed = rows[:, np.flatnonzero(closed)]
+    open_total = row_sums(to_open)
+    closed_total = row_sums(to_closed)
+
+    has_open = open_total > 0
+    dead_end = ~has_open & (closed_total > 0)
+
+    R = scale_rows(to_open, np.divide(1.0, open_total, out=np.zeros(len(open_total)), where=has_open))
+    Q = scale_rows(to_closed, np.divide(1.0, closed_total, out=np.zeros(len(closed_total)), where=dead_end))
+    return Q, R
+
+
+def reachable_exits(Q, R):
+    # Closed schools whose students can eventually reach an open school, found by
+    # walking back from the rows with direct open weight. Returns the mask and
+    # the number of passes it took (bounded by the number of closed schools).
+    reach = row_sums(R) > 0
+    iterations = 0
+    while True:
+        iterations += 1
+        grown = reach | (Q @ reach.astype(float) > 0)
+        if (grown == reach).all():
+            return reach, iterations
+        reach = grown
+
+
+def absorption_shares(redistribution_matrix, closed):
+    # B = (I - Q)^-1 R as a (closed x open) array, CSR for sparse input: the share of
+    # each closed school's students that ends up at each open school. Rows of schools
+    # that can't reach an open school are zero.
+    Q, R = transition_blocks(redistribution_matrix, closed)
+    reach, _ = reachable_exits(Q, R)
+    Q = scale_rows(Q, reach.astype(float))
+    if not sparse.issparse(Q):
+        return np.linalg.solve(np.eye(len(Q)) - Q, R)
+    if not Q.nnz:
+        return R
+    A = (sparse.identity(Q.shape[0], format='csc') - Q).tocsc()
+    return sparse.csr_matrix(spsolve(A, R.tocsc()))
+
+
+def solve_redistribution(student_counts, redistribution_matrix, closed_schools):
+    # Closed-form version of the redistribution: closed schools are the transient
+    # states of an absorbing Markov chain and open schools are absorbing, so the
+    # share of each closed school's students landing at each open school is
+    # B = (I - Q)^-1 R, computed with one linear solve. student_counts can also be a
+    # (rows x schools) array, e.g. one row per projected year, solved together for
+    # the same closure set.
+    student_counts = np.array(student_counts, dtype=float)
+    num_schools = student_counts.shape[-1]
+
+    closed = np.zeros(num_schools, dtype=bool)
+    closed[list(closed_schools)] = True
+    counts = np.where(closed, 0.0, student_counts)
+    stranded = np.zeros_like(counts)
+    if not closed.any():
+        return RedistributionResult(counts, stranded, 0)
+
+    Q, R = transition_blocks(redistribution_matrix, closed)
+    reach, iterations = reachable_exits(Q, R)
+
+    # Students who can never reach an open school (no weight at all, or stuck in a
+    # cycle of closed schools) are held back as stranded rather than redistributed.
+    Q = scale_rows(Q, reach.astype(float))
+    moving = student_counts[..., closed]
+    if sparse.issparse(Q):
+        # Never forms B: solve for the students passing through each closed school,
+        # y = moving (I - Q)^-1, and for each row's exit share (I - Q)^-1 R 1, so time
+        # and memory scale with the nonzeros of Q and R.
+        exit_share = row_sums(R)
+        if Q.nnz:
+            A = (sparse.identity(Q.shape[0], format='csc') - Q).tocsc()
+            moving_through = np.asarray(spsolve(A.T.tocsc(), moving.T)).reshape(moving.T.shape).T
+            exit_share = np.atleast_1d(spsolve(A, exit_share))
+        else:
+            moving_through = moving
+        counts[..., ~closed] += (R.T @ moving_through.T).T
+    else:
+        B = np.linalg.solve(np.eye(len(Q)) - Q, R)
+        counts[..., ~closed] += moving @ B
+        exit_share = B.sum(axis=1)
+    stranded[..., closed] = moving * (1.0 - exit_share)
+    stranded[np.abs(stranded) < 1e-9] = 0.0
+    return RedistributionResult(counts, stranded, iterations)
+
+
+def reallocate_student_counts(student_counts, redistribution_matrix, closed_schools):
+    return solve_redistribution(student_counts, redistribution_matrix, closed_schools).counts
+
+
+if __name__ == '__main__':
+    import time
+    import pandas as pd
+
+    data = pd.read_csv('data/performance_data_2023.csv')
+    matrix = pd.read_csv('data/redistribution_matrix.csv', index_col=0).values
+    counts = data['Total AAFTE* Enrollment (ENROLLMENT)'].values
+
+    # Timing by number of closures, to check it stays flat up to closing every school
+    rng = np.random.default_rng(0)
+    for k in (1, 10, 20, 35, 50, 73):
+        closed = rng.choice(len(counts), k, replace=False)
+        start = time.perf_counter()
+        for _ in range(100):
+            result = solve_redistribution(counts, matrix, closed)
+        elapsed = (time.perf_counter() - start) / 100
+        print(f"{k:>3} closed: {elapsed*1000:.3f} ms, stranded {result.stranded.sum():.1f}")
@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+WRS_TABLE = 'data/wrs_table.csv'
+# Per-building costs from the district's Well-Resourced Schools update, saved when a building closes
+BUILDING_COSTS = ["Principal's Official Staff", 'WSS Non Teaching/Support', 'Mitigation Funding', 'Custodial',
+                  'Nutrition', 'Utilities', 'Transportation', 'Grounds', 'Maintenance']
+# Budget regressors, as in the notebook's model: total enrollment and the program enrollments
+STUDENT_COLUMNS = ['Total AAFTE* Enrollment (ENROLLMENT)', 'Special Education (ENROLLMENT)',
+                   'Bilingual Education (ENROLLMENT)', 'Free and Reduced Lunch (ENROLLMENT)']
+# The notebook fits on these years and holds out 2023-24
+FIT_YEARS = ['2021-22', '2022-23']
+
+# fixed: building costs saved by closing each school
+# marginal: budget per student at each school, saved where students leave and spent where they arrive
+# coefficients: the budget regression's intercept and per-student coefficients, r2 its fit
+CostModel = namedtuple('CostModel', ['fixed', 'marginal', 'coefficients', 'r2'])
+
+
+def building_costs(wrs_table, names, schools):
+    # Annual building costs per school, in the order of 'schools'. The WRS table uses
+    # short names ('Adams'), resolved to primary names by a names.NameIndex.
+    costs = wrs_table.assign(School=names.resolve(wrs_table['Schools'].str.strip()).to_numpy())
+    costs = costs.dropna(subset=['School']).groupby('School')[BUILDING_COSTS].sum(min_count=1)
+    return costs.reindex(schools).fillna(0).sum(axis=1).to_numpy()
+
+
+def fit_budget(extract, years=FIT_YEARS):
+    # Least-squares fit of Total Budget on the STUDENT_COLUMNS, returning the
+    # coefficients (intercept first) and R^2
+    rows = extract[extract['Year'].isin(years)].dropna(subset=STUDENT_COLUMNS + ['Total Budget (BUDGET)'])
+    X = np.column_stack([np.ones(len(rows)), rows[STUDENT_COLUMNS].to_numpy(dtype=float)])
+    y = rows['Total Budget (BUDGET)'].to_numpy(dtype=float)
+    coefficients, *_ = np.linalg.lstsq(X, y, rcond=None)
+    residual = y - X @ coefficients
+    return coefficients, 1 - (residual @ residual) / ((y - y.mean()) @ (y - y.mean()))
+
+
+def fit_cost_model(wrs_table, extract, names, schools):
+    # Each school's marginal cost is the regression's per-student coefficient plus its
+    # program coefficients weighted by the school's latest program shares, so students
+    # moving in are costed at the receiving school's mix
+    coefficients, r2 = fit_budget(extract)
+    latest = extract[extract['Year'] == extract['Year'].max()].drop_duplicates('School').set_index('School')
+    latest = latest.reindex(schools)
+    shares = latest[STUDENT_COLUMNS[1:]].to_numpy(dtype=float) / latest[[STUDENT_COLUMNS[0]]].to_numpy(dtype=float)
+    shares = np.nan_to_num(shares, nan=0.0, posinf=0.0)
+    marginal = coefficients[1] + shares @ coefficients[2:]
+    return CostModel(building_costs(wrs_table, names, schools), marginal, coefficients, r2)
+
+
+def net_savings(model, closure_mask, before, after, stranded):
+    # Annual district savings for one closure set or a (scenarios x schools) batch, as
+    # dot products: building costs of the closed schools, plus the per-student cost of
+    # every student a school loses, less the cost of every student a school gains.
+    # 'after' is enrollment after redistribution, zero at closed schools. 'stranded' is
+    # the students per closed school with no open school to go to: they're missing from
+    # 'after' but still need seats, so their cost isn't counted as saved.
+    closure_mask = np.asarray(closure_mask, dtype=float)
+    moved = np.asarray(before, dtype=float) - np.asarray(after, dtype=float) - np.asarray(stranded, dtype=float)
+    return closure_mask @ model.fixed + moved @ model.marginal
+
+
+if __name__ == '__main__':
+    from data_loader import cost_model, load_data
+    from presets import PROPOSED_OPTION_A, PROPOSED_OPTION_B
+    from scenarios import evaluate_scenarios
+
+    checksum, data, matrix, counts = load_data()
+    model = cost_model(checksum)
+    print(f"Budget = {model.coefficients[0]:,.0f} + " + ' + '.join(f"{c:,.0f} x {name}" for c, name in zip(model.coefficients[1:], STUDENT_COLUMNS))
+          + f" (R^2 {model.r2:.3f})")
+    for name, option in (('Option A', PROPOSED_OPTION_A), ('Option B', PROPOSED_OPTION_B)):
+        mask = data['School'].isin(option).to_numpy()
+        results = evaluate_scenarios(counts, matrix, data['Capacity'], mask, cost_model=model)
+        print(f"{name}: ${results['savings'][0]:,.0f} a year, ${mask @ model.fixed:,.0f} of it building costs")
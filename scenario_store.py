@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from engine import Engine
+from presets import PRESETS
+from redistribution import solve_redistribution
+
+
+STORE_PATH = 'data/.cache/scenarios.sqlite'
+# Least recently used scenarios beyond this many are dropped; presets are never dropped
+MAX_SCENARIOS = 20000
+QUERY_PARAM = 'scenario'
+
+
+def encode_scenario(checksum, closed_mask):
+    # Compact, URL-safe form of a closure set: the data version and a bitmask of the
+    # closed schools, e.g. 'ffb6c93b-AAAgAAEAAAAAAA'
+    bits = base64.urlsafe_b64encode(np.packbits(np.asarray(closed_mask, dtype=bool)).tobytes()).decode().rstrip('=')
+    return f'{checksum[:8]}-{bits}'
+
+
+def decode_scenario(value, checksum, num_schools):
+    # Closure mask from encode_scenario's string. Raises ValueError for a malformed value
+    # or one made for a different version of the data, where the bits would point at
+    # different schools.
+    version, _, bits = value.partition('-')
+    if version != checksum[:8]:
+        raise ValueError('scenario was saved for a different version of the data')
+    try:
+        packed = np.frombuffer(base64.urlsafe_b64decode(bits + '=' * (-len(bits) % 4)), dtype=np.uint8)
+    except (ValueError, TypeError):
+        raise ValueError('malformed scenario')
+    if len(packed) != (num_schools + 7) // 8:
+        raise ValueError('malformed scenario')
+    return np.unpackbits(packed)[:num_schools].astype(bool)
+
+
+def scenario_key(checksum, closed_mask):
+    # Canonical key: the same closed schools under the same data version always hash
+    # the same, whatever order or filters picked them
+    return hashlib.sha256(f'{checksum}:{encode_scenario(checksum, closed_mask)}'.encode()).hexdigest()[:32]
+
+
+class ScenarioStore:
+    # Solved scenarios in SQLite: the counts after redistribution and the students
+    # stranded per school, keyed by scenario_key. Shared by every session and process on
+    # the machine, and kept across restarts. The metric tiles aren't kept, since they
+    # depend on the capacity thresholds picked in the sidebar.
+
+    def __init__(self, path=STORE_PATH, max_scenarios=MAX_SCENARIOS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_scenarios = max_scenarios
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            # Stores written before the tiles were dropped are simply rebuilt
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(scenarios)')]
+            if 'tiles' in columns:
+                self.connection.execute('DROP TABLE scenarios')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS scenarios (
+                key TEXT PRIMARY KEY, checksum TEXT NOT NULL, scenario TEXT NOT NULL,
+                counts BLOB NOT NULL, stranded BLOB NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0, hits INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL, used REAL NOT NULL)''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS scenarios_used ON scenarios (pinned, used)')
+
+    def get(self, checksum, closed_mask):
+        # (counts, stranded), or None if the scenario hasn't been solved
+        key = scenario_key(checksum, closed_mask)
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT counts, stranded FROM scenarios WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE scenarios SET hits = hits + 1, used = ? WHERE key = ?', (time.time(), key))
+        counts, stranded = row
+        return np.frombuffer(counts, dtype=float), np.frombuffer(stranded, dtype=float)
+
+    def put(self, checksum, closed_mask, counts, stranded, pinned=False):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO scenarios (key, checksum, scenario, counts, stranded, pinned, hits, created, used) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+                (scenario_key(checksum, closed_mask), checksum, encode_scenario(checksum, closed_mask),
+                 np.asarray(counts, dtype=float).tobytes(), np.asarray(stranded, dtype=float).tobytes(),
+                 int(pinned), now, now))
+            self.connection.execute(
+                'DELETE FROM scenarios WHERE key IN (SELECT key FROM scenarios WHERE pinned = 0 ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_scenarios,))
+
+    def discard_other_versions(self, checksum):
+        # Scenarios solved for older data can never be served again
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM scenarios WHERE checksum != ?', (checksum,))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM scenarios').fetchone()[0]
+
+
+def warm_up(store, engine):
+    # Solve every preset button's closure set ahead of the first visitor, pinned so
+    # eviction never drops them, along with the default view of no closures. A handful of
+    # solves, so they're simply redone.
+    for preset in [{}, *PRESETS.values()]:
+        closed = np.zeros(len(engine.schools), dtype=bool)
+        closed[engine.closure_set(**preset)] = True
+        result = solve_redistribution(engine.counts, engine.matrix, np.flatnonzero(closed))
+        store.put(engine.checksum, closed, result.counts, result.stranded, pinned=True)
+
+
+@lru_cache(maxsize=2)
+def open_store(checksum, path=STORE_PATH):
+    # Once per process and data version: drop stale scenarios and warm up the presets
+    store = ScenarioStore(path)
+    store.discard_other_versions(checksum)
+    warm_up(store, Engine())
+    return store
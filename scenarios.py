@@ -0,0 +1,143 @@
+import numpy as np
+
+from capacity_buckets import bucket_tiles, classify, transition_matrix
+from redistribution import as_weights, row_sums, solve_redistribution
+from savings import net_savings
+
+
+# Column order of the 'tiles' array, matching the five metric tiles in the app
+TILE_NAMES = ["Students' Assignments Unchanged*", 'Schools Remaining Open', 'Schools Under 75% Capacity',
+              'Schools Between 75-100% Capacity', 'Schools Over 100% Capacity']
+
+
+def masks_from_sets(closed_sets, num_schools):
+    # One row per closure set, True where the school is closed
+    mask = np.zeros((len(closed_sets), num_schools), dtype=bool)
+    for row, closed in enumerate(closed_sets):
+        mask[row, list(closed)] = True
+    return mask
+
+
+def single_change_masks(base_mask):
+    # Every closure set one step away from base_mask: close one more school, reopen
+    # one closed school, or swap a closed school for an open one.
+    base_mask = np.asarray(base_mask, dtype=bool)
+    closed = np.flatnonzero(base_mask)
+    opened = np.flatnonzero(~base_mask)
+
+    add = np.repeat(base_mask[None, :], len(opened), axis=0)
+    add[np.arange(len(opened)), opened] = True
+    remove = np.repeat(base_mask[None, :], len(closed), axis=0)
+    remove[np.arange(len(closed)), closed] = False
+
+    out_idx, in_idx = np.meshgrid(closed, opened, indexing='ij')
+    swap = np.repeat(base_mask[None, :], out_idx.size, axis=0)
+    rows = np.arange(out_idx.size)
+    swap[rows, out_idx.ravel()] = False
+    swap[rows, in_idx.ravel()] = True
+    return np.concatenate([add, remove, swap])
+
+
+def redistribute_batch(student_counts, weights, closed):
+    # Final counts for a (scenarios x schools) closure mask using one matrix product
+    # per chunk. Returns the counts, students stranded per school, and a flag for
+    # scenarios whose closed schools only point at other closed schools; those
+    # need the chained solve in redistribution.py.
+    # Products are written as weights @ x so a sparse weights matrix works unchanged
+    opened = ~closed
+    moving = np.where(closed, student_counts, 0.0)
+    open_total = (weights @ opened.T.astype(float)).T
+    has_open = closed & (open_total > 0)
+
+    share = np.divide(moving, open_total, out=np.zeros_like(moving), where=has_open)
+    counts = np.where(opened, student_counts, 0.0) + (weights.T @ share.T).T * opened
+
+    row_total = row_sums(weights)
+    no_weight = closed & (row_total[None, :] == 0)
+    stranded = moving * no_weight
+    chained = (closed & ~has_open & ~no_weight & (moving > 0)).any(axis=1)
+    return counts, stranded, chained
+
+
+def capacity_tiles(student_counts, transitions, closed):
+    # Values shown in the five metric tiles, one row per scenario
+    unchanged = student_counts.sum() - (closed * student_counts).sum(axis=1)
+    values, _ = bucket_tiles(transitions)
+    return np.column_stack([unchanged, values])
+
+
+def evaluate_scenarios(student_counts, redistribution_matrix, capacity, closure_mask, chunk_size=1024, thresholds=(0.75, 1.0),
+                       cost_model=None):
+    # Evaluate many closure sets at once. closure_mask is a boolean array of shape
+    # (n_scenarios, n_schools). Work is done chunk_size scenarios at a time so memory
+    # stays at a few (chunk_size x n_schools) arrays however many scenarios are passed.
+    # With a savings.CostModel, each scenario's net annual savings is added as 'savings'.
+    # 'enrollment' is truncated to whole students like the app's tables; 'counts' is the
+    # same before truncation.
+    student_counts = np.asarray(student_counts, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    closure_mask = np.atleast_2d(np.asarray(closure_mask, dtype=bool))
+    weights = as_weights(redistribution_matrix)
+
+    num_scenarios, num_schools = closure_mask.shape
+    enrollment = np.empty((num_scenarios, num_schools))
+    after = np.empty((num_scenarios, num_schools))
+    stranded = np.empty(num_scenarios)
+    savings = np.empty(num_scenarios)
+
+    for start in range(0, num_scenarios, chunk_size):
+        closed = closure_mask[start:start + chunk_size]
+        counts, chunk_stranded, chained = redistribute_batch(student_counts, weights, closed)
+        for row in np.flatnonzero(chained):
+            result = solve_redistribution(student_counts, weights, np.flatnonzero(closed[row]))
+            counts[row] = result.counts
+            chunk_stranded[row] = result.stranded
+        # Same whole-student truncation the app applies to 'Enrollment from Redistribution'
+        enrollment[start:start + chunk_size] = student_counts + np.trunc(counts - student_counts)
+        after[start:start + chunk_size] = counts
+        stranded[start:start + chunk_size] = chunk_stranded.sum(axis=1)
+        if cost_model is not None:
+            # Savings on the untruncated counts: students dropped by the truncation are
+            # still enrolled somewhere and still cost the district
+            savings[start:start + chunk_size] = net_savings(cost_model, closed, student_counts, counts, chunk_stranded)
+
+    redistribution_capacity = enrollment / capacity
+    transitions = transition_matrix(classify(student_counts / capacity, thresholds=thresholds),
+                                     classify(redistribution_capacity, closure_mask, thresholds))
+    results = {
+        'enrollment': enrollment,
+        'counts': after,
+        'redistribution_capacity': redistribution_capacity,
+        'stranded': stranded,
+        'transitions': transitions,
+        'tiles': capacity_tiles(student_counts, transitions, closure_mask),
+    }
+    if cost_model is not None:
+        results['savings'] = savings
+    return results
+
+
+if __name__ == '__main__':
+    import time
+    import pandas as pd
+    from presets import PROPOSED_OPTION_A, PROPOSED_OPTION_B
+
+    data = pd.read_csv('data/performance_data_2023.csv')
+    matrix = pd.read_csv('data/redistribution_matrix.csv', index_col=0).values
+    counts = data['Total AAFTE* Enrollment (ENROLLMENT)'].values
+    capacity = data['Capacity'].values
+
+    # Sweep every closure set one add, removal or swap away from Options A and B (16-22 closures)
+    masks = np.concatenate([single_change_masks(data['School'].isin(option).values)
+                            for option in (PROPOSED_OPTION_A, PROPOSED_OPTION_B)])
+    masks = np.concatenate([masks] * 10)
+    start = time.perf_counter()
+    results = evaluate_scenarios(counts, matrix, capacity, masks)
+    elapsed = time.perf_counter() - start
+    print(f"{len(masks)} scenarios in {elapsed:.3f} s, {len(masks)/elapsed:,.0f} scenarios/s")
+
+    start = time.perf_counter()
+    for mask in masks[:500]:
+        solve_redistribution(counts, matrix, np.flatnonzero(mask))
+    elapsed = time.perf_counter() - start
+    print(f"one at a time: {500/elapsed:,.0f} scenarios/s")
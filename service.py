@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+from engine import Engine
+
+
+# JSON over HTTP, stdlib only. Run with:  python service.py [--port 8502] [--processes 4]
+#
+#   GET  /health     data checksum and number of schools
+#   GET  /schools    school names, in the row order used for indexes and results
+#   POST /simulate   {"closed": ["Sanislo Elementary", 12]}
+#                    {"scenarios": [[...], [...], {"schools": [...], "ranges": {"Capacity Percent": [0, 0.65]},
+#                                                  "categories": {"Use": ["E"]}}],
+#                     "per_school": true}
+#
+# Each scenario is a list of schools by name or row index, or an object that also picks
+# schools with the sidebar's filters. /simulate returns, per scenario, the closed rows,
+# the metric tile totals, stranded students, estimated annual savings, and unless
+# per_school is false, each school's enrollment and capacity after the closures.
+#
+# Batches of at least POOL_MIN_SCENARIOS run in a process pool, split into chunks of
+# POOL_CHUNK scenarios, so large sweeps use every core and don't hold up other requests.
+POOL_MIN_SCENARIOS = 64
+POOL_CHUNK = 2000
+MAX_SCENARIOS = 200000
+MAX_BODY = 64 * 2**20
+
+logger = logging.getLogger('sps.service')
+
+_engine = None
+
+
+def _init_worker():
+    # Each pool process loads the data once
+    global _engine
+    _engine = Engine()
+
+
+def _evaluate(closed_sets, per_school):
+    return _engine.evaluate(closed_sets, per_school)
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class SimulationService:
+
+    def __init__(self, processes=None):
+        self.engine = Engine()
+        self.processes = processes or os.cpu_count()
+        self.pool = None
+
+    def start_pool(self):
+        # The workers are forked here, from the main thread, and not on the first batch:
+        # batches are submitted from request threads, and forking from a thread can
+        # copy locks held by the others into the workers
+        self.pool = ProcessPoolExecutor(self.processes, initializer=_init_worker)
+        self.pool.submit(int).result()
+
+    def closed_sets(self, body):
+        if 'scenarios' in body:
+            scenarios = body['scenarios']
+        elif 'closed' in body:
+            scenarios = [body['closed']]
+        else:
+            raise RequestError("expected 'closed' or 'scenarios'")
+        if not isinstance(scenarios, list) or len(scenarios) > MAX_SCENARIOS:
+            raise RequestError(f"'scenarios' must be a list of at most {MAX_SCENARIOS} closure sets")
+
+        closed_sets = []
+        for scenario in scenarios:
+            if isinstance(scenario, dict):
+                closed = self.engine.closure_set(scenario.get('schools', []), scenario.get('ranges'), scenario.get('categories'))
+            elif isinstance(scenario, list):
+                closed = self.engine.resolve(scenario)
+            else:
+                raise RequestError('each scenario must be a list of schools or an object')
+            closed_sets.append(closed)
+        return closed_sets
+
+    def simulate(self, body):
+        # The whole /simulate request, from the raw body to the encoded response. It runs
+        # in a worker thread (see route), since parsing a large body, resolving names and
+        # encoding per-school results take as long as the evaluation itself; large
+        # batches are then split across the process pool.
+        try:
+            body = json.loads(body or b'{}')
+        except json.JSONDecodeError as error:
+            raise RequestError(f'invalid JSON: {error}')
+        if not isinstance(body, dict):
+            raise RequestError('expected a JSON object')
+        try:
+            closed_sets = self.closed_sets(body)
+        except ValueError as error:
+            raise RequestError(str(error))
+        per_school = bool(body.get('per_school', True))
+        started = time.perf_counter()
+        if self.pool is None or len(closed_sets) < POOL_MIN_SCENARIOS:
+            scenarios = self.engine.evaluate(closed_sets, per_school)
+        else:
+            futures = [self.pool.submit(_evaluate, closed_sets[first:first + POOL_CHUNK], per_school)
+                       for first in range(0, len(closed_sets), POOL_CHUNK)]
+            scenarios = [scenario for future in futures for scenario in future.result()]
+        logger.info(json.dumps({'event': 'simulate', 'scenarios': len(closed_sets),
+                                'ms': round((time.perf_counter() - started) * 1000, 2)}))
+        return json.dumps({'checksum': self.engine.checksum, 'scenarios': scenarios}).encode()
+
+    async def route(self, method, path, body):
+        # A dict to send as JSON, or a response already encoded
+        if path == '/health' and method == 'GET':
+            return {'status': 'ok', 'checksum': self.engine.checksum, 'schools': len(self.engine.schools)}
+        if path == '/schools' and method == 'GET':
+            return {'checksum': self.engine.checksum, 'schools': self.engine.schools.tolist()}
+        if path == '/simulate' and method == 'POST':
+            return await asyncio.to_thread(self.simulate, body)
+        if path in ('/health', '/schools', '/simulate'):
+            raise RequestError(f'{method} not allowed on {path}', HTTPStatus.METHOD_NOT_ALLOWED)
+        raise RequestError(f'no such path {path}', HTTPStatus.NOT_FOUND)
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1: one request at a time per connection, kept alive unless the
+        # client asks to close it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0) or 0)
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                try:
+                    if length > MAX_BODY:
+                        raise RequestError('request body too large', HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = HTTPStatus.OK, await self.route(method, target.split('?')[0], body)
+                except RequestError as error:
+                    status, payload = error.status, {'error': str(error)}
+                    keep_alive = keep_alive and length <= MAX_BODY
+                except Exception:
+                    logger.exception('%s %s failed', method, target)
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'internal error'}
+
+                content = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(content)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.start_pool()
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(json.dumps({'event': 'listening', 'host': host, 'port': port, 'processes': self.processes,
+                                'checksum': self.engine.checksum}))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve school closure simulations as JSON over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--processes', type=int, help='worker processes for large batches (default: one per core)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    asyncio.run(SimulationService(args.processes).serve(args.host, args.port))
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+STORE_DIR = 'data/store/performance_data_2023'
+SOURCE = 'data/performance_data_2023.csv'
+SCHEMA_VERSION = 1
+
+# Loaded as pandas categoricals. Every other text column is dictionary-encoded on disk
+# too, but loaded as plain strings.
+CATEGORICAL_COLUMNS = ['Use', 'Landmark', 'Building Condition']
+
+
+def source_hash(path=SOURCE):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_store(data, path=STORE_DIR, source=SOURCE):
+    # Columns are grouped by type into one (columns x rows) .npy per type, so each column
+    # is a contiguous row that can be memory-mapped, with three files to open instead of
+    # one per column. Text columns are stored as int32 codes into a list of values kept in
+    # schema.json, with -1 for missing values.
+    os.makedirs(path, exist_ok=True)
+    blocks = {}
+    columns = []
+    for column, values in data.items():
+        entry = {'name': column}
+        if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            array = values.to_numpy()
+            entry['kind'] = 'numeric'
+        else:
+            categorical = pd.Categorical(values)
+            array = categorical.codes.astype(np.int32)
+            entry['kind'] = 'categorical' if column in CATEGORICAL_COLUMNS else 'text'
+            entry['categories'] = [str(value) for value in categorical.categories]
+        entry['block'] = array.dtype.name
+        entry['position'] = len(blocks.setdefault(entry['block'], []))
+        blocks[entry['block']].append(array)
+        columns.append(entry)
+
+    for block, arrays in blocks.items():
+        np.save(os.path.join(path, f'{block}.npy'), np.stack(arrays), allow_pickle=False)
+    schema = {'version': SCHEMA_VERSION, 'rows': len(data), 'source': source,
+              'source_sha256': source_hash(source), 'blocks': sorted(blocks), 'columns': columns}
+    with open(os.path.join(path, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=1)
+    return schema
+
+
+def read_schema(path=STORE_DIR):
+    with open(os.path.join(path, 'schema.json')) as f:
+        return json.load(f)
+
+
+def is_current(path=STORE_DIR, source=SOURCE):
+    # True when the store exists and was built from the current version of the source CSV
+    try:
+        schema = read_schema(path)
+    except FileNotFoundError:
+        return False
+    return schema['version'] == SCHEMA_VERSION and schema['source_sha256'] == source_hash(source)
+
+
+def load_store(path=STORE_DIR, mmap=True):
+    # Numeric columns are read-only views into memory-mapped blocks, shared between
+    # processes through the page cache; the frame is built around them without copying.
+    schema = read_schema(path)
+    blocks = {block: np.load(os.path.join(path, f'{block}.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+              for block in schema['blocks']}
+    columns = {}
+    for entry in schema['columns']:
+        array = blocks[entry['block']][entry['position']]
+        if entry['kind'] == 'numeric':
+            columns[entry['name']] = array
+        elif entry['kind'] == 'categorical':
+            columns[entry['name']] = pd.Categorical.from_codes(array, dtype=pd.CategoricalDtype(entry['categories']))
+        else:
+            values = np.array(entry['categories'] + [None], dtype=object)
+            columns[entry['name']] = pd.array(values[array], dtype='str')
+    return pd.DataFrame(columns, copy=False)
+
+
+if __name__ == '__main__':
+    from data_loader import clean_performance_data
+
+    start = time.perf_counter()
+    data = clean_performance_data(pd.read_csv(SOURCE))
+    csv_time = time.perf_counter() - start
+    build_store(data)
+
+    start = time.perf_counter()
+    stored = load_store()
+    store_time = time.perf_counter() - start
+    pd.testing.assert_frame_equal(load_store(mmap=False).astype({column: 'str' for column in CATEGORICAL_COLUMNS}), data, check_dtype=False)
+    print(f"{STORE_DIR}: {len(stored.columns)} columns, {len(stored)} rows. Load {store_time*1000:.1f} ms vs {csv_time*1000:.1f} ms parsing and cleaning the CSV")
@@ -0,0 +1,31 @@
+# Display formats of the numeric columns, for st.column_config. Percent columns hold
+# percentages (65.4 for 65.4%) and are only rounded when shown.
+TABLE_FORMATS = {'Capacity Percent': '%.2f%%', 'Beginning Capacity %': '%.2f%%', 'Ending Capacity %': '%.0f%%',
+                 'Distance to Closest Open School (miles)': '%.2f', 'Chance Over 100%': '%d%%'}
+
+
+def reorder(dataframe, front, rows=slice(None)):
+    # The rows kept, with the front columns first and then every other column but the
+    # notebook's cluster labels, as one selection rather than a copy per moved column
+    rest = [col for col in dataframe.columns if col not in front and 'Cluster_' not in col]
+    return dataframe.loc[rows, front + rest]
+
+
+def closing_schools_table(filtered_data):
+    # 'By closing the following schools...' table
+    table = reorder(filtered_data, ['School', 'Use', 'Total AAFTE* Enrollment (ENROLLMENT)', 'Capacity', 'Capacity Percent'])
+    table['Capacity Percent'] = table['Capacity Percent'] * 100
+    return table.rename(columns={'Total AAFTE* Enrollment (ENROLLMENT)': 'Enrollment'})
+
+
+def impacted_schools_table(data):
+    # 'You impact these schools...' table, the schools receiving redistributed students
+    table = reorder(data, ['School', 'Use', 'Total AAFTE* Enrollment (ENROLLMENT)', 'Enrollment from Redistribution', 'Total Enrollment',
+                           'Capacity', 'Capacity Percent', 'Redistribution Capacity'],
+                    data['Enrollment from Redistribution'].to_numpy() > 0)
+    table.insert(6, 'Ending Excess Capacity', table['Capacity'] - table['Total Enrollment'])
+    table['Capacity Percent'] = table['Capacity Percent'] * 100
+    table['Redistribution Capacity'] = table['Redistribution Capacity'] * 100
+    return table.rename(columns={'Capacity': 'Building Capacity', 'Excess Capacity': 'Beginning Excess Capacity',
+                                 'Total AAFTE* Enrollment (ENROLLMENT)': 'Beginning Enrollment', 'Capacity Percent': 'Beginning Capacity %',
+                                 'Redistribution Capacity': 'Ending Capacity %', 'Enrollment from Redistribution': 'Additional Students'})
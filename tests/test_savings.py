@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from redistribution import solve_redistribution
+from savings import CostModel, net_savings
+from scenarios import evaluate_scenarios
+
+
+MODEL = CostModel(fixed=np.array([1000.0, 2000.0, 3000.0]), marginal=np.array([10.0, 20.0, 30.0]), coefficients=None, r2=None)
+COUNTS = np.array([50.0, 100.0, 100.0])
+CAPACITY = np.full(3, 300.0)
+
+
+@pytest.mark.parametrize('weights, closed, stranded', [
+    # School 0 sends its students nowhere
+    (np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0]]), [0], 50.0),
+    # Schools 0 and 1 only send students to each other, which needs the chained solve
+    (np.array([[0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]), [0, 1], 150.0),
+])
+def test_stranded_students_are_not_saved(weights, closed, stranded):
+    # Closing only strands students, so the savings are just the buildings closed
+    mask = np.isin(np.arange(3), closed)
+    result = solve_redistribution(COUNTS, weights, closed)
+    assert result.stranded.sum() == stranded
+    assert net_savings(MODEL, mask, COUNTS, result.counts, result.stranded) == MODEL.fixed[mask].sum()
+    results = evaluate_scenarios(COUNTS, weights, CAPACITY, mask, cost_model=MODEL)
+    np.testing.assert_allclose(results['stranded'], [stranded])
+    np.testing.assert_allclose(results['savings'], [MODEL.fixed[mask].sum()])
+
+
+def test_moved_students_cost_the_receiving_school():
+    # School 1's 100 students move to school 2, which costs 10 a student more
+    weights = np.array([[0.0, 0.0, 1.0], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0]])
+    mask = np.array([False, True, False])
+    result = solve_redistribution(COUNTS, weights, [1])
+    assert net_savings(MODEL, mask, COUNTS, result.counts, result.stranded) == 2000.0 - 100 * 10.0
@@ -0,0 +1,129 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from redistribution import as_weights, reachable_exits, transition_blocks
+
+
+# enrollment, capacity: one row per requested percentile, one column per school
+# p_over: share of draws in which the school ends above 100% capacity
+UncertaintyBands = namedtuple('UncertaintyBands', ['percentiles', 'enrollment', 'capacity', 'p_over', 'num_draws'])
+
+# Elements of the per-draw chain-to-chain blocks built at once (128 MB of floats), so
+# long chains of closed schools are solved a few draws at a time
+MAX_CHAIN_ELEMENTS = 2 ** 24
+
+
+def draw_inflow(student_counts, weights, closed, totals, num_draws, seed=0):
+    # Students arriving at each school in each of num_draws resampled matrices,
+    # (num_draws x schools). Each closed school's row is redrawn from a Dirichlet whose
+    # concentration is the students behind that row (weight x totals), so rows built from
+    # few students vary more. Only the closed rows' nonzeros are sampled, as one
+    # (num_draws x nonzeros) gamma array: normalizing gammas gives the Dirichlet draw,
+    # and the row normalization cancels out when the row is renormalized over open schools.
+    rng = np.random.default_rng(seed)
+    closed_idx = np.flatnonzero(closed)
+    rows = sparse.csr_matrix(weights[closed_idx])
+    rows.eliminate_zeros()
+    num_closed, num_schools = rows.shape
+    entry_row = np.repeat(np.arange(num_closed), np.diff(rows.indptr))
+    entry_col = rows.indices
+    to_open = ~closed[entry_col]
+
+    alpha = rows.data * np.maximum(totals[closed_idx], 1.0)[entry_row]
+    draws = rng.gamma(alpha, size=(num_draws, len(alpha)))
+
+    open_rows = sparse.csr_matrix((np.ones(to_open.sum()), (np.flatnonzero(to_open), entry_row[to_open])), shape=(len(alpha), num_closed))
+    open_total = draws @ open_rows
+    moving = np.broadcast_to(student_counts[closed_idx], (num_draws, num_closed)).copy()
+
+    # Closed schools with no open weight pass their students on through other closed
+    # schools. Which rows do this, and which can reach an open school at all, is the
+    # same in every draw since sampling keeps each row's nonzeros.
+    Q, R = transition_blocks(weights, closed)
+    reach, _ = reachable_exits(Q, R)
+    dead_end = np.asarray(open_rows.sum(axis=0)).ravel() == 0
+    chain = np.flatnonzero(dead_end & reach)
+    if len(chain):
+        position = np.full(num_closed, -1)
+        position[chain] = np.arange(len(chain))
+        entries = (position[entry_row] >= 0) & ~to_open
+        chain_rows = position[entry_row[entries]]
+        targets = np.searchsorted(closed_idx, entry_col[entries])
+        closed_total = np.zeros((num_draws, len(chain)))
+        np.add.at(closed_total.T, chain_rows, draws[:, entries].T)
+        # Q_E per draw, kept as the values of its nonzeros: row chain_rows, column targets
+        Q_draws = draws[:, entries] / closed_total[:, chain_rows]
+
+        # Students passing through each chained school y solve (I - Q_EE^T) y = moving_E.
+        # Only the chain-to-chain block is dense, built for as many draws at a time as fit
+        # in MAX_CHAIN_ELEMENTS.
+        inner = position[targets] >= 0
+        identity = np.eye(len(chain))
+        through = np.empty((num_draws, len(chain)))
+        step = max(1, MAX_CHAIN_ELEMENTS // len(chain) ** 2)
+        for first in range(0, num_draws, step):
+            block = slice(first, first + step)
+            Q_EE_T = np.zeros((len(through[block]), len(chain), len(chain)))
+            Q_EE_T[:, position[targets[inner]], chain_rows[inner]] = Q_draws[block][:, inner]
+            through[block] = np.linalg.solve(identity - Q_EE_T, moving[block][:, chain, None])[..., 0]
+
+        # Then they flow on to the rest of the closed schools
+        onward = sparse.csr_matrix((np.ones(len(targets)), (np.arange(len(targets)), targets)), shape=(len(targets), num_closed))
+        moving += (through[:, chain_rows] * Q_draws) @ onward
+        moving[:, chain] = through
+
+    share = np.divide(moving, open_total, out=np.zeros_like(moving), where=open_total > 0)
+    open_columns = sparse.csr_matrix((np.ones(to_open.sum()), (np.arange(to_open.sum()), entry_col[to_open])),
+                                     shape=(to_open.sum(), num_schools))
+    return (draws[:, to_open] * share[:, entry_row[to_open]]) @ open_columns
+
+
+def _draw_chunk(args):
+    return draw_inflow(*args)
+
+
+def simulate(student_counts, redistribution_matrix, closed, capacity, num_draws=2000, totals=None,
+             percentiles=(5, 50, 95), seed=0, processes=None, chunk_size=2500):
+    # Percentile bands of each school's Total Enrollment and Redistribution Capacity over
+    # num_draws resampled redistribution matrices, plus the chance of ending over 100%.
+    #   closed: boolean mask of closed schools
+    #   totals: students behind each matrix row (defaults to the school's enrollment)
+    # Draws are made chunk_size at a time, in a process pool when processes is set.
+    student_counts = np.asarray(student_counts, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    closed = np.asarray(closed, dtype=bool)
+    totals = student_counts if totals is None else np.asarray(totals, dtype=float)
+    weights = as_weights(redistribution_matrix)
+
+    sizes = [min(chunk_size, num_draws - start) for start in range(0, num_draws, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    chunks = [(student_counts, weights, closed, totals, size, s) for size, s in zip(sizes, seeds)]
+    if processes and len(chunks) > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            inflow = np.concatenate(list(pool.map(_draw_chunk, chunks)))
+    else:
+        inflow = np.concatenate([_draw_chunk(chunk) for chunk in chunks])
+
+    # Same whole-student truncation as the deterministic 'Enrollment from Redistribution'
+    enrollment = np.where(closed, 0.0, student_counts + np.trunc(inflow))
+    capacity_draws = enrollment / capacity
+    return UncertaintyBands(percentiles, np.percentile(enrollment, percentiles, axis=0),
+                            np.percentile(capacity_draws, percentiles, axis=0), (capacity_draws > 1.0).mean(axis=0), num_draws)
+
+
+if __name__ == '__main__':
+    import time
+    from data_loader import load_data, sampling_totals
+    from presets import PROPOSED_OPTION_A
+
+    checksum, data, matrix, counts = load_data()
+    closed = data['School'].isin(PROPOSED_OPTION_A).to_numpy()
+    for num_draws, processes in ((2000, None), (20000, None), (20000, os.cpu_count())):
+        start = time.perf_counter()
+        bands = simulate(counts, matrix, closed, data['Capacity'], num_draws, sampling_totals(checksum), processes=processes)
+        print(f"{num_draws} draws ({processes or 1} processes): {time.perf_counter() - start:.3f} s, "
+              f"{(bands.p_over > 0.5).sum()} schools likely over capacity")
@@ -0,0 +1,137 @@
+import numpy as np
+from scipy import sparse
+
+from redistribution import as_weights, row_sums, solve_redistribution
+
+
+class SimulationState:
+    # Keeps the last closure set and its solved counts so toggling a few schools in the
+    # sidebar only touches the rows involved.
+    #
+    # Open schools receive inflow = share @ W, where share[i] = students[i] / open_total[i]
+    # for each closed school i and open_total[i] is its weight to schools still open.
+    # Closing or reopening school t changes open_total only for rows with weight to t,
+    # so the inflow gets a low-rank correction from those rows instead of a full
+    # re-solve, and only the schools those rows send students to get new counts.
+    # Closed schools that only point at other closed schools need the chained solve
+    # in redistribution.py, so those cases fall back to it.
+
+    def __init__(self, student_counts, redistribution_matrix, max_toggles=4):
+        self.student_counts = np.array(student_counts, dtype=float)
+        self.weights = as_weights(redistribution_matrix)
+        # Column access for toggles; CSC when the weights are sparse
+        self.columns = self.weights.tocsc() if sparse.issparse(self.weights) else self.weights
+        self.row_total = row_sums(self.weights)
+        self.max_toggles = max_toggles
+        # version: incremented by every update, so results derived from the counts can
+        # tell whether 'changed' is relative to the counts they were built from
+        self.version = 0
+        self.reset(np.zeros(len(self.student_counts), dtype=bool))
+
+    def reset(self, closed):
+        # Full solve for a closure mask, rebuilding all incremental state
+        self.closed = np.array(closed, dtype=bool)
+        self.open_total = self.weights @ (~self.closed).astype(float)
+        self.share = np.zeros(len(self.student_counts))
+        self.share[self.closed] = self._shares(np.flatnonzero(self.closed))
+        self.inflow = self.weights.T @ self.share
+        self.stuck = self._stuck(np.arange(len(self.student_counts)))
+        self.num_chained = int((self.stuck & (self.row_total > 0)).sum())
+        self._solve()
+        self.changed = np.ones(len(self.student_counts), dtype=bool)
+        self.toggles = None
+
+    def _shares(self, rows):
+        total = self.open_total[rows]
+        return np.divide(self.student_counts[rows], total, out=np.zeros(len(rows)), where=total > 1e-12)
+
+    def _stuck(self, rows):
+        # Closed schools with students but no open weight left. Those with some weight
+        # (to closed schools only) need the chained solve, the rest are stranded.
+        return self.closed[rows] & (self.open_total[rows] <= 1e-12) & (self.student_counts[rows] > 0)
+
+    def _column(self, school):
+        # Rows with weight to the school, and those weights
+        if sparse.issparse(self.columns):
+            start, end = self.columns.indptr[school], self.columns.indptr[school + 1]
+            return self.columns.indices[start:end], self.columns.data[start:end]
+        rows = np.flatnonzero(self.columns[:, school])
+        return rows, self.columns[rows, school]
+
+    def _receiving(self, rows):
+        # Schools the given rows send students to
+        if sparse.issparse(self.weights):
+            return np.unique(self.weights[rows].indices)
+        return np.flatnonzero(self.weights[rows].any(axis=0))
+
+    def _solve(self):
+        # iterations: passes the chained solve needed, 0 when it wasn't run
+        if self.num_chained:
+            result = solve_redistribution(self.student_counts, self.weights, np.flatnonzero(self.closed))
+            self.counts = result.counts
+            self.stranded = result.stranded
+            self.iterations = result.iterations
+        else:
+            self.iterations = 0
+            self.counts = np.where(self.closed, 0.0, self.student_counts + self.inflow)
+            self.stranded = np.where(self.stuck, self.student_counts, 0.0)
+
+    def toggle(self, school):
+        # Close an open school or reopen a closed one. Returns the schools whose counts
+        # or status changed.
+        pointing, weight = self._column(school)
+        was_closed = self.closed[school]
+        was_chained = self.num_chained > 0
+        self.closed[school] = not was_closed
+        self.open_total[pointing] += weight if was_closed else -weight
+
+        # Rows whose share changes: closed schools pointing at the toggled school,
+        # plus the toggled school itself
+        rows = np.union1d(pointing[self.closed[pointing]], [school])
+        new_share = np.zeros(len(rows))
+        still_closed = self.closed[rows]
+        new_share[still_closed] = self._shares(rows[still_closed])
+        delta = new_share - self.share[rows]
+        touched = rows[delta != 0]
+
+        self.share[rows] = new_share
+        self.inflow += self.weights[touched].T @ delta[delta != 0]
+
+        # Only rows pointing at the toggled school can have lost or regained open weight
+        affected = np.union1d(pointing, [school])
+        has_weight = self.row_total[affected] > 0
+        stuck = self._stuck(affected)
+        self.num_chained += int((stuck & has_weight).sum() - (self.stuck[affected] & has_weight).sum())
+        self.stuck[affected] = stuck
+
+        if self.num_chained or was_chained:
+            before = self.counts
+            self._solve()
+            return np.flatnonzero((np.abs(self.counts - before) > 1e-9) | (np.arange(len(self.counts)) == school))
+
+        self.iterations = 0
+        schools = np.union1d(self._receiving(touched), [school]) if len(touched) else np.array([school])
+        before = self.counts[schools]
+        self.counts[schools] = np.where(self.closed[schools], 0.0, self.student_counts[schools] + self.inflow[schools])
+        self.stranded[affected] = np.where(stuck, self.student_counts[affected], 0.0)
+        return schools[(np.abs(self.counts[schools] - before) > 1e-9) | (schools == school)]
+
+    def update(self, closed_schools):
+        # Move to a new closure set, toggling when only a few schools differ and
+        # re-solving from scratch otherwise. Sets self.changed to the schools whose
+        # counts moved or that were opened or closed, and self.toggles to the number of
+        # toggles applied (None after a full re-solve).
+        closed = np.zeros(len(self.student_counts), dtype=bool)
+        closed[list(closed_schools)] = True
+        toggles = np.flatnonzero(closed != self.closed)
+        self.version += 1
+        if len(toggles) > self.max_toggles:
+            self.reset(closed)
+            return self.counts
+
+        changed = np.zeros(len(self.student_counts), dtype=bool)
+        for school in toggles:
+            changed[self.toggle(school)] = True
+        self.changed = changed
+        self.toggles = len(toggles)
+        return self.counts